@@ -0,0 +1,126 @@
+import threading
+import time
+
+from flask import g, jsonify, request
+
+# Admission control and load shedding.
+# Every request takes a slot before its view runs (and so before bcrypt or any
+# SQLite work). When no slot is free it waits in a bounded queue for its
+# priority class; if the queue is full or its deadline passes it is answered
+# right away with 503 and Retry-After instead of being processed after the
+# client has given up.
+#
+# Priority classes:
+#   high   - cheap reads, shed last; they may use every slot
+#   normal - everything not listed in ADMISSION_PRIORITIES
+#   low    - expensive work (password hashing, writes, imports), shed first
+# Lower classes may only use a share of the slots, and a freed slot always goes
+# to a waiting request of a higher class first.
+
+PRIORITIES = ('high', 'normal', 'low')
+
+DEFAULT_CLASSES = {
+    'high': {'share': 1.0, 'queue': 64, 'timeout': 2.0},
+    'normal': {'share': 0.75, 'queue': 32, 'timeout': 1.0},
+    'low': {'share': 0.5, 'queue': 8, 'timeout': 0.5},
+}
+
+class AdmissionControl:
+    def __init__(self, app=None):
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.route_in_flight = {}
+        self.waiting = dict.fromkeys(PRIORITIES, 0)
+        self.counters = {p: {'admitted': 0, 'queued': 0, 'shed_queue_full': 0, 'shed_timeout': 0}
+                         for p in PRIORITIES}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ADMISSION_MAX_CONCURRENCY', 16)
+        app.config.setdefault('ADMISSION_ROUTE_LIMITS', {})
+        app.config.setdefault('ADMISSION_PRIORITIES', {})
+        app.config.setdefault('ADMISSION_CLASSES', DEFAULT_CLASSES)
+        app.config.setdefault('ADMISSION_RETRY_AFTER', 1)
+        app.config.setdefault('ADMISSION_EXEMPT', ['static'])
+        self.app = app
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+
+    def _can_admit(self, endpoint, priority):
+        config = self.app.config
+        if self.in_flight >= config['ADMISSION_MAX_CONCURRENCY'] * config['ADMISSION_CLASSES'][priority]['share']:
+            return False
+        route_limit = config['ADMISSION_ROUTE_LIMITS'].get(endpoint)
+        if route_limit is not None and self.route_in_flight.get(endpoint, 0) >= route_limit:
+            return False
+        higher = PRIORITIES[:PRIORITIES.index(priority)]
+        return not any(self.waiting[p] for p in higher)
+
+    def _admit(self, endpoint, priority):
+        self.in_flight += 1
+        self.route_in_flight[endpoint] = self.route_in_flight.get(endpoint, 0) + 1
+        self.counters[priority]['admitted'] += 1
+
+    def acquire(self, endpoint, priority):
+        """Take a slot for endpoint, waiting if needed. Returns None or the reason it was shed."""
+        settings = self.app.config['ADMISSION_CLASSES'][priority]
+        with self.condition:
+            if self._can_admit(endpoint, priority):
+                self._admit(endpoint, priority)
+                return None
+            if self.waiting[priority] >= settings['queue']:
+                self.counters[priority]['shed_queue_full'] += 1
+                return 'queue_full'
+
+            self.waiting[priority] += 1
+            self.counters[priority]['queued'] += 1
+            deadline = time.monotonic() + settings['timeout']
+            try:
+                while not self._can_admit(endpoint, priority):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counters[priority]['shed_timeout'] += 1
+                        return 'timeout'
+                    self.condition.wait(remaining)
+            finally:
+                self.waiting[priority] -= 1
+                # Lower classes blocked behind this waiter may now proceed
+                self.condition.notify_all()
+            self._admit(endpoint, priority)
+            return None
+
+    def release(self, endpoint):
+        with self.condition:
+            self.in_flight -= 1
+            self.route_in_flight[endpoint] -= 1
+            self.condition.notify_all()
+
+    def _before_request(self):
+        endpoint = request.endpoint
+        if endpoint is None or endpoint in self.app.config['ADMISSION_EXEMPT']:
+            return None
+        priority = self.app.config['ADMISSION_PRIORITIES'].get(endpoint, 'normal')
+        reason = self.acquire(endpoint, priority)
+        if reason is not None:
+            response = jsonify({"message": "Server is busy, please retry later", "reason": reason})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(self.app.config['ADMISSION_RETRY_AFTER'])
+            return response
+        g.admission_endpoint = endpoint
+        return None
+
+    def _teardown_request(self, exc):
+        endpoint = g.pop('admission_endpoint', None)
+        if endpoint is not None:
+            self.release(endpoint)
+
+    def stats(self):
+        with self.condition:
+            return {
+                'max_concurrency': self.app.config['ADMISSION_MAX_CONCURRENCY'],
+                'in_flight': self.in_flight,
+                'route_in_flight': {k: v for k, v in self.route_in_flight.items() if v},
+                'waiting': dict(self.waiting),
+                'classes': {p: dict(c) for p, c in self.counters.items()},
+            }
@@ -1,25 +1,61 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from marshmallow import Schema, fields, validate
+from marshmallow import Schema, ValidationError, fields, validate
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from flask_bcrypt import Bcrypt
 from flask_httpauth import HTTPBasicAuth
+from sqlalchemy import event, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 from functools import wraps
+from werkzeug.exceptions import HTTPException, MethodNotAllowed
+from werkzeug.utils import secure_filename
+import click
+import io
+import json
+import os
+import sys
+import course_import
+import export
+from admission import AdmissionControl
+from audit_policy import AuditPolicy
+from jobs import JobQueue
+from slow_queries import SlowQueryLog
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///courses2.db'
+# LMS_DATABASE_URI points the app at another database, e.g. a scratch one in tests
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('LMS_DATABASE_URI', 'sqlite:///courses2.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['COURSE_STATS_BUCKET_SIZE'] = 10  # Width in hours of the duration histogram buckets
+# Admission control: cheap reads are shed last, expensive writes and imports first
+app.config['ADMISSION_PRIORITIES'] = {
+    'get_courses': 'high', 'get_course': 'high', 'get_course_stats': 'high',
+    'create_course': 'low', 'update_course': 'low', 'delete_course': 'low',
+    'import_courses': 'low', 'export_table': 'low', 'enqueue_job': 'low',
+}
+app.config['ADMISSION_ROUTE_LIMITS'] = {'import_courses': 1, 'export_table': 2}
+app.config['ADMISSION_EXEMPT'] = ['static', 'get_admission_stats']
+app.config['EXPORT_DIR'] = 'exports'  # Where background export and archive jobs write their files
+# Read events are sampled or rolled up into per-minute counters; writes are always logged in full
+app.config['AUDIT_POLICIES'] = {
+    'view_courses': {'mode': 'rollup'},
+    'view_course': {'mode': 'sample', 'rate': 0.01},
+    'view_course_stats': {'mode': 'rollup'},
+}
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
 auth = HTTPBasicAuth()
+admission = AdmissionControl(app)
+jobs = JobQueue(app, db)
 
 limiter = Limiter(
     key_func=get_remote_address,
     app=app,
     default_limits=["200 per day", "50 per hour"]
 )
+slow_queries = SlowQueryLog(app, db)
 
 # Models
 class Course(db.Model):
@@ -30,6 +66,9 @@ class Course(db.Model):
     duration = db.Column(db.Integer, nullable=False)
     enrollment_limit = db.Column(db.Integer)
 
+# Natural key used by the bulk import to upsert courses
+course_natural_key = db.Index('ix_course_title_instructor', Course.title, Course.instructor, unique=True)
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
@@ -43,6 +82,8 @@ class AuditLog(db.Model):
     action = db.Column(db.String(50), nullable=False)
     details = db.Column(db.String(500))
 
+audit_policy = AuditPolicy(app, db, AuditLog)
+
 class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
@@ -57,6 +98,15 @@ role_permissions = db.Table('role_permissions',
     db.Column('permission_id', db.Integer, db.ForeignKey('permission.id'), primary_key=True)
 )
 
+# Course summaries, keyed by (dimension, key):
+# ('total', ''), ('instructor', <name>) and ('duration', <bucket start>)
+class CourseStat(db.Model):
+    dimension = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    course_count = db.Column(db.Integer, nullable=False, default=0)
+    total_duration = db.Column(db.Integer, nullable=False, default=0)
+    total_enrollment_limit = db.Column(db.Integer, nullable=False, default=0)
+
 # Schemas
 class CourseSchema(Schema):
     id = fields.Int(dump_only=True)
@@ -77,13 +127,15 @@ def verify_password(username, password):
         return user
 
 # Permissions
+def user_permissions(user):
+    role = Role.query.filter_by(name=user.role).first()
+    return {p.name for p in role.permissions} if role else set()
+
 def check_permission(permission):
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            user = auth.current_user()
-            role = Role.query.filter_by(name=user.role).first()
-            if role and permission in [p.name for p in role.permissions]:
+            if permission in user_permissions(auth.current_user()):
                 return f(*args, **kwargs)
             return jsonify({"message": "Permission denied"}), 403
         return decorated_function
@@ -96,14 +148,140 @@ def log_audit(action, details):
     db.session.add(audit_log)
     db.session.commit()
 
+def log_read_audit(action, details):
+    audit_policy.record(auth.current_user().id, action, lambda: log_audit(action, details))
+
+# Course statistics
+def duration_bucket(duration):
+    # Used for both the incremental updates and the full scan, so their keys always agree
+    size = app.config['COURSE_STATS_BUCKET_SIZE']
+    return str(int(duration) // size * size)
+
+def _course_stat_keys(instructor, duration):
+    return [('total', ''), ('instructor', instructor), ('duration', duration_bucket(duration))]
+
+def _course_values(course, committed):
+    values = {}
+    for attr in ('instructor', 'duration', 'enrollment_limit'):
+        history = inspect(course).attrs[attr].load_history()
+        if committed and history.deleted:
+            values[attr] = history.deleted[0]
+        else:
+            values[attr] = getattr(course, attr)
+    return values
+
+def _add_course_delta(deltas, values, sign):
+    for stat_key in _course_stat_keys(values['instructor'], values['duration']):
+        delta = deltas.setdefault(stat_key, [0, 0, 0])
+        delta[0] += sign
+        delta[1] += sign * values['duration']
+        delta[2] += sign * (values['enrollment_limit'] or 0)
+
+@event.listens_for(db.session, 'before_flush')
+def update_course_stats(session, flush_context, instances):
+    # Apply the change of every created, updated or deleted course to the
+    # summaries inside the same transaction, so /courses/stats never scans Course
+    deltas = {}
+    for obj in session.new:
+        if isinstance(obj, Course):
+            _add_course_delta(deltas, _course_values(obj, committed=False), 1)
+    for obj in session.dirty:
+        if isinstance(obj, Course) and session.is_modified(obj):
+            _add_course_delta(deltas, _course_values(obj, committed=True), -1)
+            _add_course_delta(deltas, _course_values(obj, committed=False), 1)
+    for obj in session.deleted:
+        if isinstance(obj, Course):
+            _add_course_delta(deltas, _course_values(obj, committed=True), -1)
+    if not deltas:
+        return
+
+    # Executed on the connection directly so it does not trigger a nested autoflush
+    connection = session.connection()
+    if connection.execute(select(CourseStat.dimension).where(CourseStat.dimension == 'total')).first() is None:
+        # First course write on a catalog that predates the summaries: seed them from
+        # the current rows before applying this flush's changes
+        with session.no_autoflush:
+            stats = scan_course_stats()
+        for (dimension, key), (count, duration, limit) in stats.items():
+            connection.execute(insert(CourseStat).values(dimension=dimension, key=key, course_count=count,
+                                                         total_duration=duration, total_enrollment_limit=limit))
+    for (dimension, key), (count, duration, limit) in deltas.items():
+        if count == duration == limit == 0:
+            continue
+        stmt = insert(CourseStat).values(dimension=dimension, key=key, course_count=count,
+                                         total_duration=duration, total_enrollment_limit=limit)
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['dimension', 'key'],
+            set_={
+                'course_count': CourseStat.course_count + count,
+                'total_duration': CourseStat.total_duration + duration,
+                'total_enrollment_limit': CourseStat.total_enrollment_limit + limit,
+            }))
+    connection.execute(CourseStat.__table__.delete().where(
+        CourseStat.dimension != 'total', CourseStat.course_count <= 0))
+
+def scan_course_stats():
+    """Compute the course summaries from a full scan of Course."""
+    stats = {}
+    columns = (func.count(Course.id), func.coalesce(func.sum(Course.duration), 0),
+               func.coalesce(func.sum(Course.enrollment_limit), 0))
+    stats[('total', '')] = tuple(db.session.query(*columns).one())
+    for instructor, *values in db.session.query(Course.instructor, *columns).group_by(Course.instructor):
+        stats[('instructor', instructor)] = tuple(values)
+    for duration, *values in db.session.query(Course.duration, *columns).group_by(Course.duration):
+        key = ('duration', duration_bucket(duration))
+        stats[key] = tuple(a + b for a, b in zip(stats.get(key, (0, 0, 0)), values))
+    return stats
+
+def recompute_course_stats():
+    stats = scan_course_stats()
+    CourseStat.query.delete()
+    for (dimension, key), (count, duration, limit) in stats.items():
+        db.session.add(CourseStat(dimension=dimension, key=key, course_count=count,
+                                  total_duration=duration, total_enrollment_limit=limit))
+    db.session.commit()
+    return len(stats)
+
+def stored_course_stats():
+    return {(s.dimension, s.key): (s.course_count, s.total_duration, s.total_enrollment_limit)
+            for s in CourseStat.query.all()}
+
+def _stat_dict(stat):
+    return {
+        "course_count": stat.course_count,
+        "total_duration": stat.total_duration,
+        "average_duration": stat.total_duration / stat.course_count if stat.course_count else None,
+        "total_enrollment_limit": stat.total_enrollment_limit,
+    }
+
 # Routes
+@app.route('/courses/stats', methods=['GET'])
+@auth.login_required
+@check_permission('view_courses')
+@limiter.limit("30 per minute")
+def get_course_stats():
+    if CourseStat.query.get(('total', '')) is None:
+        recompute_course_stats()
+    stats = CourseStat.query.all()
+    total = next((s for s in stats if s.dimension == 'total'), CourseStat(course_count=0, total_duration=0, total_enrollment_limit=0))
+    size = app.config['COURSE_STATS_BUCKET_SIZE']
+    instructors = sorted((s for s in stats if s.dimension == 'instructor'), key=lambda s: s.key)
+    buckets = sorted((s for s in stats if s.dimension == 'duration'), key=lambda s: int(s.key))
+    log_read_audit('view_course_stats', 'Retrieved course statistics')
+    return jsonify({
+        **_stat_dict(total),
+        "instructors": [{"instructor": s.key, **_stat_dict(s)} for s in instructors],
+        "duration_histogram": [{"bucket_start": int(s.key), "bucket_end": int(s.key) + size,
+                                "course_count": s.course_count} for s in buckets],
+    }), 200
+
 @app.route('/courses', methods=['GET'])
 @auth.login_required
 @check_permission('view_courses')
 @limiter.limit("30 per minute")
 def get_courses():
     courses = Course.query.all()
-    log_audit('view_courses', 'Retrieved all courses')
+    log_read_audit('view_courses', 'Retrieved all courses')
     return jsonify(courses_schema.dump(courses)), 200
 
 @app.route('/courses/<int:course_id>', methods=['GET'])
@@ -112,7 +290,7 @@ def get_courses():
 @limiter.limit("60 per minute")
 def get_course(course_id):
     course = Course.query.get_or_404(course_id)
-    log_audit('view_course', f'Retrieved course with id {course_id}')
+    log_read_audit('view_course', f'Retrieved course with id {course_id}')
     return jsonify(course_schema.dump(course)), 200
 
 @app.route('/courses', methods=['POST'])
@@ -120,13 +298,17 @@ def get_course(course_id):
 @check_permission('create_course')
 @limiter.limit("10 per minute")
 def create_course():
-    data = request.json
-    errors = course_schema.validate(data)
-    if errors:
-        return jsonify(errors), 400
+    try:
+        data = course_schema.load(request.json)
+    except ValidationError as e:
+        return jsonify(e.messages), 400
     new_course = Course(**data)
     db.session.add(new_course)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "A course with this title and instructor already exists"}), 409
     log_audit('create_course', f'Created new course: {new_course.title}')
     return jsonify(course_schema.dump(new_course)), 201
 
@@ -136,13 +318,17 @@ def create_course():
 @limiter.limit("10 per minute")
 def update_course(course_id):
     course = Course.query.get_or_404(course_id)
-    data = request.json
-    errors = course_schema.validate(data)
-    if errors:
-        return jsonify(errors), 400
+    try:
+        data = course_schema.load(request.json)
+    except ValidationError as e:
+        return jsonify(e.messages), 400
     for key, value in data.items():
         setattr(course, key, value)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({"message": "A course with this title and instructor already exists"}), 409
     log_audit('update_course', f'Updated course with id {course_id}')
     return jsonify(course_schema.dump(course)), 200
 
@@ -152,14 +338,472 @@ def update_course(course_id):
 @limiter.limit("5 per minute")
 def delete_course(course_id):
     course = Course.query.get_or_404(course_id)
+    if request.args.get('async', 'false').lower() in ('1', 'true'):
+        job_id = jobs.enqueue('delete_course', {'course_id': course_id, 'user_id': auth.current_user().id})
+        log_audit('delete_course', f'Queued deletion of course with id {course_id} as job {job_id}')
+        return job_accepted(job_id)
     db.session.delete(course)
     db.session.commit()
     log_audit('delete_course', f'Deleted course with id {course_id}')
     return '', 204
 
+# Monitoring
+@app.route('/admin/slow-queries', methods=['GET'])
+@auth.login_required
+@check_permission('view_slow_queries')
+def get_slow_queries():
+    return jsonify(slow_queries.snapshot(request.args.get('limit', 50, type=int))), 200
+
+@app.route('/admin/admission', methods=['GET'])
+@auth.login_required
+@check_permission('view_metrics')
+def get_admission_stats():
+    return jsonify(admission.stats()), 200
+
+# Background jobs
+def job_accepted(job_id):
+    response = jsonify({"job_id": job_id, "status_url": f'/jobs/{job_id}'})
+    response.status_code = 202
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response
+
+def export_path(filename):
+    os.makedirs(app.config['EXPORT_DIR'], exist_ok=True)
+    return os.path.join(app.config['EXPORT_DIR'], secure_filename(filename))
+
+def new_export_path(filename):
+    # A file without a checkpoint is a finished export (or archive, whose rows are already deleted), never overwrite it.
+    # Checked at enqueue and again when the job runs, since another job may have written the file in between.
+    output = export_path(filename)
+    if os.path.exists(output) and not os.path.exists(output + '.ckpt'):
+        raise ValueError(f"'{secure_filename(filename)}' already exists in the export directory; pick another filename")
+    return output
+
+# Payload validators: enqueue calls them so a bad payload is answered with 400 instead of failing in the worker
+def require_filename(payload):
+    if not isinstance(payload.get('filename'), str) or not secure_filename(payload['filename']):
+        raise ValueError("'filename' must be a file name")
+    new_export_path(payload['filename'])
+
+def require_datetime(payload, key, required=False):
+    if payload.get(key) is None and not required:
+        return
+    try:
+        datetime.fromisoformat(payload.get(key))
+    except (TypeError, ValueError):
+        raise ValueError(f"'{key}' must be an ISO 8601 date or datetime")
+
+def validate_delete_course_payload(payload):
+    if not isinstance(payload.get('course_id'), int):
+        raise ValueError("'course_id' must be an integer")
+    return payload
+
+def validate_export_payload(payload):
+    if payload.get('table') not in EXPORT_MODELS:
+        raise ValueError(f"'table' must be one of {', '.join(EXPORT_MODELS)}")
+    require_filename(payload)
+    if payload.get('format', 'csv') not in export.FORMATS:
+        raise ValueError(f"'format' must be one of {', '.join(export.FORMATS)}")
+    if not isinstance(payload.get('gzip', False), bool):
+        raise ValueError("'gzip' must be true or false")
+    require_datetime(payload, 'since')
+    require_datetime(payload, 'until')
+    actions = payload.get('actions', [])
+    if not isinstance(actions, list) or not all(isinstance(action, str) for action in actions):
+        raise ValueError("'actions' must be a list of strings")
+    if EXPORT_MODELS[payload['table']] not in EXPORT_TIME_COLUMNS and (payload.get('since') or payload.get('until') or actions):
+        raise ValueError("time and action filters only apply to audit_log and audit_rollup")
+    return payload
+
+def validate_archive_audit_log_payload(payload):
+    require_datetime(payload, 'before', required=True)
+    require_filename(payload)
+    return payload
+
+@jobs.handler('delete_course', max_concurrency=1, validate=validate_delete_course_payload)
+def delete_course_job(payload, progress):
+    course = Course.query.get(payload['course_id'])
+    if course is None:
+        return {"deleted": False}
+    db.session.delete(course)
+    db.session.add(AuditLog(user_id=payload['user_id'], action='delete_course',
+                            details=f'Deleted course with id {payload["course_id"]}'))
+    db.session.commit()
+    return {"deleted": True}
+
+@jobs.handler('recompute_course_stats', max_concurrency=1)
+def recompute_course_stats_job(payload, progress):
+    return {"rows": recompute_course_stats()}
+
+@jobs.handler('rebuild_indexes', max_concurrency=1)
+def rebuild_indexes_job(payload, progress):
+    db.session.execute(db.text('REINDEX'))
+    progress(0.5, 'Reindexed, analyzing')
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+    return {}
+
+@jobs.handler('export', max_concurrency=2, validate=validate_export_payload)
+def export_job(payload, progress):
+    model = EXPORT_MODELS[payload['table']]
+    since = datetime.fromisoformat(payload['since']) if payload.get('since') else None
+    until = datetime.fromisoformat(payload['until']) if payload.get('until') else None
+    filters = export_filters(model, since, until, payload.get('actions', ()))
+    total = max(db.session.query(func.count(model.id)).filter(*filters).scalar(), 1)
+    output = new_export_path(payload['filename'])
+    # The checkpoint lets a retried job continue where the failed attempt stopped
+    rows, elapsed = export.export_to_file(
+        db.session, model, output, fmt=payload.get('format', 'csv'), compress=payload.get('gzip', False),
+        filters=filters, options=export_options(since, until, payload.get('actions', ())), checkpoint=output + '.ckpt',
+        progress=lambda written, rate: progress(min(written / total, 1.0), f'{written} rows ({rate:.0f} rows/s)'))
+    os.remove(output + '.ckpt')
+    return {"path": output, "rows": rows, "seconds": elapsed}
+
+@jobs.handler('archive_audit_log', max_concurrency=1, validate=validate_archive_audit_log_payload)
+def archive_audit_log_job(payload, progress):
+    # Write audit entries older than 'before' to a gzip JSONL file, then delete them in small transactions
+    before = datetime.fromisoformat(payload['before'])
+    output = new_export_path(payload['filename'])
+    export.export_to_file(db.session, AuditLog, output, fmt='jsonl', compress=True,
+                          filters=[AuditLog.timestamp < before], options={'before': before.isoformat()},
+                          checkpoint=output + '.ckpt')
+    last_id = export.read_checkpoint(output + '.ckpt')['last_id']
+    progress(0.5, 'Archived, deleting')
+    total = max(AuditLog.query.filter(AuditLog.timestamp < before, AuditLog.id <= last_id).count(), 1)
+    deleted = 0
+    while True:
+        ids = [row.id for row in db.session.query(AuditLog.id)
+               .filter(AuditLog.timestamp < before, AuditLog.id <= last_id).limit(1000)]
+        if not ids:
+            break
+        AuditLog.query.filter(AuditLog.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+        progress(0.5 + 0.5 * min(deleted / total, 1.0), f'{deleted} entries deleted')
+    os.remove(output + '.ckpt')
+    return {"path": output, "archived": deleted}
+
+@app.route('/jobs', methods=['POST'])
+@auth.login_required
+@check_permission('manage_jobs')
+@limiter.limit("10 per minute")
+def enqueue_job():
+    data = request.get_json(silent=True) or {}
+    job_type = data.get('type')
+    if job_type not in jobs.handlers:
+        return jsonify({"message": f"Job type must be one of {', '.join(sorted(jobs.handlers))}"}), 400
+    payload = data.get('payload') or {}
+    if not isinstance(payload, dict):
+        return jsonify({"message": "'payload' must be an object"}), 400
+    payload['user_id'] = auth.current_user().id
+    try:
+        job_id = jobs.enqueue(job_type, payload)
+    except ValueError as e:
+        return jsonify({"message": f"Invalid {job_type} payload: {e}"}), 400
+    log_audit('enqueue_job', f'Queued {job_type} job {job_id}')
+    return job_accepted(job_id)
+
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+@auth.login_required
+@check_permission('manage_jobs')
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({"message": "Job not found"}), 404
+    return jsonify(job), 200
+
+# Batch requests
+BATCH_MAX_SIZE = 50
+BATCH_ENDPOINTS = {'get_courses': 'view_courses', 'get_course': 'view_course'}
+
+def batch_cost():
+    # Each sub-request counts as one request against the batch rate limit
+    sub_requests = (request.get_json(silent=True) or {}).get('requests')
+    return max(len(sub_requests), 1) if isinstance(sub_requests, list) else 1
+
+@app.route('/batch', methods=['POST'])
+@auth.login_required
+@limiter.limit("60 per minute", cost=batch_cost)
+def batch():
+    data = request.get_json(silent=True) or {}
+    sub_requests = data.get('requests')
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({"message": "'requests' must be a non-empty list"}), 400
+    if len(sub_requests) > BATCH_MAX_SIZE:
+        return jsonify({"message": f"A batch can hold at most {BATCH_MAX_SIZE} requests"}), 400
+
+    # Resolve every sub-request against the URL map before touching the database
+    urls = app.url_map.bind('')
+    resolved = []
+    for sub_request in sub_requests:
+        if not isinstance(sub_request, dict) or not isinstance(sub_request.get('path'), str):
+            resolved.append((400, {"message": "Each request needs a 'path'"}))
+            continue
+        method = sub_request.get('method', 'GET')
+        if not isinstance(method, str):
+            resolved.append((400, {"message": "'method' must be a string"}))
+            continue
+        try:
+            endpoint, args = urls.match(sub_request['path'], method.upper())
+        except MethodNotAllowed:
+            resolved.append((405, {"message": "Method not allowed"}))
+            continue
+        except HTTPException:
+            resolved.append((404, {"message": "Not found"}))
+            continue
+        if endpoint not in BATCH_ENDPOINTS:
+            resolved.append((400, {"message": "Only course reads can be batched"}))
+            continue
+        resolved.append((endpoint, args))
+
+    # One permission lookup and one query per kind of read for the whole batch
+    permissions = user_permissions(auth.current_user())
+    wanted = [r for r in resolved if r[0] in BATCH_ENDPOINTS and BATCH_ENDPOINTS[r[0]] in permissions]
+    course_ids = {args['course_id'] for endpoint, args in wanted if endpoint == 'get_course'}
+    courses = {c.id: c for c in Course.query.filter(Course.id.in_(course_ids))} if course_ids else {}
+    all_courses = None
+    if any(endpoint == 'get_courses' for endpoint, _ in wanted):
+        all_courses = courses_schema.dump(Course.query.all())
+
+    responses = []
+    for endpoint, args in resolved:
+        if endpoint not in BATCH_ENDPOINTS:
+            responses.append({"status": endpoint, "body": args})
+        elif BATCH_ENDPOINTS[endpoint] not in permissions:
+            responses.append({"status": 403, "body": {"message": "Permission denied"}})
+        elif endpoint == 'get_courses':
+            responses.append({"status": 200, "body": all_courses})
+        elif args['course_id'] in courses:
+            responses.append({"status": 200, "body": course_schema.dump(courses[args['course_id']])})
+        else:
+            responses.append({"status": 404, "body": {"message": "Course not found"}})
+
+    log_read_audit('batch', f'Batch of {len(sub_requests)} requests, course ids: {sorted(course_ids)}'[:500])
+    return jsonify({"responses": responses}), 200
+
+# Imports
+def find_duplicate_courses():
+    """Return (title, instructor, ids) for every natural key held by more than one course."""
+    rows = (db.session.query(Course.title, Course.instructor, func.group_concat(Course.id))
+            .group_by(Course.title, Course.instructor).having(func.count(Course.id) > 1).all())
+    return [(title, instructor, sorted(int(i) for i in ids.split(','))) for title, instructor, ids in rows]
+
+def create_course_natural_key():
+    # Catalogs created before the key may hold duplicates, which would make CREATE UNIQUE INDEX fail
+    duplicates = find_duplicate_courses()
+    if duplicates:
+        raise click.ClickException(f'{len(duplicates)} title/instructor pairs are used by more than one course; '
+                                   'run "flask dedupe-courses" to list them and "flask dedupe-courses --merge" '
+                                   'to keep the oldest course of each')
+    course_natural_key.create(db.engine, checkfirst=True)
+
+@app.route('/courses/import', methods=['POST'])
+@auth.login_required
+@check_permission('import_courses')
+@limiter.limit("5 per minute")
+def import_courses():
+    upload = request.files.get('file')
+    if upload is None:
+        return jsonify({"message": "Upload the courses as a 'file' form field"}), 400
+    fmt = request.form.get('format') or os.path.splitext(upload.filename or '')[1].lstrip('.').lower()
+    if fmt not in course_import.FORMATS:
+        return jsonify({"message": f"Format must be one of {', '.join(course_import.FORMATS)}"}), 400
+
+    # Only the first rejects are returned; the counts cover all of them
+    rejects = []
+    def on_reject(line, row, errors):
+        if len(rejects) < 100:
+            rejects.append({"line": line, "row": row, "errors": errors})
+
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8', newline='')
+    result = course_import.import_courses(db.session, Course, course_schema,
+                                          course_import.iter_rows(stream, fmt), on_reject=on_reject)
+    log_audit('import_courses', f'Imported courses from {upload.filename}: {result["inserted"]} inserted, '
+                                f'{result["updated"]} updated, {result["rejected"]} rejected')
+    return jsonify({**result, "rejects": rejects}), 200
+
+@app.cli.command('import-courses')
+@click.argument('source', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(course_import.FORMATS),
+              help='Input format; defaults to the file extension.')
+@click.option('--rejects', help='File to write invalid rows to, one JSON object per line.')
+@click.option('--chunk-size', default=500, show_default=True)
+def import_courses_command(source, fmt, rejects, chunk_size):
+    """Upsert courses from a CSV or JSONL file, keyed on title and instructor."""
+    fmt = fmt or os.path.splitext(source)[1].lstrip('.').lower()
+    if fmt not in course_import.FORMATS:
+        raise click.UsageError('Cannot tell the format from the file name; pass --format')
+    create_course_natural_key()
+
+    reject_file = open(rejects, 'w') if rejects else None
+    def on_reject(line, row, errors):
+        if reject_file:
+            reject_file.write(json.dumps({"line": line, "row": row, "errors": errors}) + '\n')
+
+    def progress(result):
+        click.echo(f'{result["inserted"] + result["updated"]} rows upserted, {result["rejected"]} rejected '
+                   f'({result["rows_per_second"]:.0f} rows/s)')
+
+    try:
+        with open(source, encoding='utf-8', newline='') as f:
+            result = course_import.import_courses(db.session, Course, course_schema,
+                                                  course_import.iter_rows(f, fmt), chunk_size=chunk_size,
+                                                  on_reject=on_reject, progress=progress)
+    finally:
+        if reject_file:
+            reject_file.close()
+    click.echo(f'{result["inserted"]} inserted, {result["updated"]} updated, {result["rejected"]} rejected '
+               f'in {result["seconds"]:.2f}s ({result["rows_per_second"]:.0f} rows/s)')
+
+@app.cli.command('dedupe-courses')
+@click.option('--merge', is_flag=True, help='Delete all but the oldest course of each duplicate pair.')
+def dedupe_courses_command(merge):
+    """List courses sharing a title and instructor, optionally merging them."""
+    duplicates = find_duplicate_courses()
+    for title, instructor, ids in duplicates:
+        click.echo(f'{title!r} by {instructor!r}: courses {", ".join(map(str, ids))}')
+    if not duplicates:
+        click.echo('No duplicate courses')
+    elif not merge:
+        raise click.ClickException(f'{len(duplicates)} duplicate title/instructor pairs; pass --merge to keep '
+                                   'the oldest course of each')
+    else:
+        # Deleted through the session so the course summaries follow
+        extra_ids = [i for _, _, ids in duplicates for i in ids[1:]]
+        for course in Course.query.filter(Course.id.in_(extra_ids)):
+            db.session.delete(course)
+        db.session.commit()
+        click.echo(f'Deleted {len(extra_ids)} duplicate courses')
+    create_course_natural_key()
+
+# Exports
+EXPORT_MODELS = {'audit_log': AuditLog, 'audit_rollup': audit_policy.model, 'courses': Course}
+# Tables that take the since/until/action filters, with the column since/until apply to
+EXPORT_TIME_COLUMNS = {AuditLog: AuditLog.timestamp, audit_policy.model: audit_policy.model.minute}
+
+def export_filters(model, since=None, until=None, actions=()):
+    filters = []
+    if since:
+        filters.append(EXPORT_TIME_COLUMNS[model] >= since)
+    if until:
+        filters.append(EXPORT_TIME_COLUMNS[model] < until)
+    if actions:
+        filters.append(model.action.in_(actions))
+    return filters
+
+def export_options(since=None, until=None, actions=()):
+    # The filter arguments as stored in export checkpoints
+    return {'since': since.isoformat() if since else None,
+            'until': until.isoformat() if until else None,
+            'actions': sorted(actions)}
+
+@app.route('/export/<table>', methods=['GET'])
+@auth.login_required
+@check_permission('export_data')
+@limiter.limit("5 per minute")
+def export_table(table):
+    model = EXPORT_MODELS.get(table)
+    if model is None:
+        return jsonify({"message": f"Unknown export table: {table}"}), 404
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        return jsonify({"message": f"Format must be one of {', '.join(export.FORMATS)}"}), 400
+    try:
+        since = datetime.fromisoformat(request.args['since']) if 'since' in request.args else None
+        until = datetime.fromisoformat(request.args['until']) if 'until' in request.args else None
+        after_id = request.args.get('after_id', 0, type=int)
+    except ValueError:
+        return jsonify({"message": "since/until must be ISO 8601 datetimes"}), 400
+    actions = request.args.getlist('action')
+    if model not in EXPORT_TIME_COLUMNS and (since or until or actions):
+        return jsonify({"message": "Time and action filters only apply to audit_log and audit_rollup"}), 400
+    compress = request.args.get('gzip', 'false').lower() in ('1', 'true')
+
+    log_audit('export_data', f'Exported {table} as {fmt}{" (gzip)" if compress else ""} after id {after_id}')
+
+    columns = model.__table__.columns.keys()
+    filters = export_filters(model, since, until, actions)
+
+    def generate():
+        rows = 0
+        started = datetime.utcnow()
+        records = export.iter_records(db.session, model, filters, after_id)
+        for record in records:
+            rows += 1
+            yield record
+        elapsed = (datetime.utcnow() - started).total_seconds()
+        app.logger.info('Exported %d %s rows in %.2fs (%.0f rows/s)', rows, table, elapsed, rows / max(elapsed, 1e-9))
+
+    # Clients resume an interrupted download with after_id set to the last id they received
+    chunks = export.iter_chunks(generate(), fmt, columns, header=after_id == 0)
+    if compress:
+        chunks = export.gzip_chunks(chunks)
+    # A gzip body is a .gz file download, not compressed CSV/JSONL content
+    response = Response(stream_with_context(chunks), mimetype='application/gzip' if compress else export.MIMETYPES[fmt])
+    filename = f'{table}.{fmt}{".gz" if compress else ""}'
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(list(EXPORT_MODELS)))
+@click.option('--output', '-o', required=True, help='File to write the export to.')
+@click.option('--format', 'fmt', type=click.Choice(export.FORMATS), default='csv')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--since', type=click.DateTime(), help='Only audit entries (or rollup minutes) at or after this time.')
+@click.option('--until', type=click.DateTime(), help='Only audit entries (or rollup minutes) before this time.')
+@click.option('--action', 'actions', multiple=True, help='Only audit entries with this action (repeatable).')
+@click.option('--checkpoint', help='Checkpoint file used to resume an interrupted export.')
+@click.option('--batch-size', default=1000, show_default=True)
+def export_command(table, output, fmt, compress, since, until, actions, checkpoint, batch_size):
+    """Stream TABLE to a CSV or JSONL file."""
+    model = EXPORT_MODELS[table]
+    if model not in EXPORT_TIME_COLUMNS and (since or until or actions):
+        raise click.UsageError('--since, --until and --action only apply to audit_log and audit_rollup')
+
+    def progress(rows, rate):
+        click.echo(f'{rows} rows written ({rate:.0f} rows/s)')
+
+    try:
+        rows, elapsed = export.export_to_file(
+            db.session, model, output, fmt=fmt, compress=compress,
+            filters=export_filters(model, since, until, actions), options=export_options(since, until, actions),
+            checkpoint=checkpoint, batch_size=batch_size, progress=progress)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if checkpoint:
+        os.remove(checkpoint)
+    click.echo(f'Exported {rows} rows to {output} in {elapsed:.2f}s ({rows / max(elapsed, 1e-9):.0f} rows/s)')
+
+@app.cli.command('recompute-course-stats')
+def recompute_course_stats_command():
+    """Rebuild the course summaries from a full scan of Course."""
+    rows = recompute_course_stats()
+    click.echo(f'Rebuilt {rows} course summary rows')
+
+@app.cli.command('check-course-stats')
+def check_course_stats_command():
+    """Compare the course summaries with a full scan of Course."""
+    expected = scan_course_stats()
+    stored = stored_course_stats()
+    mismatches = [key for key in sorted(expected.keys() | stored.keys())
+                  if expected.get(key, (0, 0, 0)) != stored.get(key, (0, 0, 0))]
+    for dimension, key in mismatches:
+        click.echo(f'{dimension} {key!r}: stored {stored.get((dimension, key))}, '
+                   f'expected {expected.get((dimension, key))}')
+    if mismatches:
+        raise click.ClickException(f'{len(mismatches)} course summary rows are inconsistent; '
+                                   'run "flask recompute-course-stats" to repair them')
+    click.echo('Course summaries are consistent')
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        try:
+            create_course_natural_key()
+        except click.ClickException as e:
+            sys.exit(f'Error: {e.message}')
+        if CourseStat.query.get(('total', '')) is None:
+            recompute_course_stats()
         
         # Create roles if they don't exist
         admin_role = Role.query.filter_by(name='admin').first()
@@ -173,7 +817,7 @@ if __name__ == '__main__':
             db.session.add(instructor_role)
         
         # Create permissions if they don't exist
-        permissions = ['view_courses', 'view_course', 'create_course', 'update_course', 'delete_course']
+        permissions = ['view_courses', 'view_course', 'create_course', 'update_course', 'delete_course', 'export_data', 'import_courses', 'view_slow_queries', 'view_metrics', 'manage_jobs']
         for perm_name in permissions:
             perm = Permission.query.filter_by(name=perm_name).first()
             if not perm:
@@ -0,0 +1,127 @@
+import atexit
+import random
+import threading
+import time
+from datetime import datetime
+
+import click
+from sqlalchemy import Column, DateTime, Integer, String, Table, UniqueConstraint, func, select
+from sqlalchemy.dialects.sqlite import insert
+
+# Audit policy for high-volume read events.
+# Writes and authentication events keep calling the app's audit helper and are
+# always logged in full. Read events go through AuditPolicy.record, which
+# applies the policy configured for their action in AUDIT_POLICIES:
+#   {'mode': 'full'}                 - one audit_log row per event (the default)
+#   {'mode': 'sample', 'rate': 0.01} - a random share of events get a full row
+#   {'mode': 'rollup'}               - no full rows
+# Every event without a full row is counted in audit_rollup per user, action and
+# minute, so count(audit_log) + sum(audit_rollup.count) is the exact number of
+# events, whatever the policy was at the time. Counters are buffered in memory
+# and flushed every AUDIT_ROLLUP_FLUSH_SECONDS by a background thread (started
+# with the first rolled-up event, so it also runs in forked workers) and at exit.
+# AuditPolicy.model maps audit_rollup so it can be queried and exported like the
+# app's own models.
+
+class AuditPolicy:
+    def __init__(self, app=None, db=None, audit_model=None):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flusher = None
+        if app is not None:
+            self.init_app(app, db, audit_model)
+
+    def init_app(self, app, db, audit_model):
+        app.config.setdefault('AUDIT_POLICIES', {})
+        app.config.setdefault('AUDIT_ROLLUP_FLUSH_SECONDS', 60)
+        self.app = app
+        self.db = db
+        self.audit_model = audit_model
+        self.table = Table(
+            'audit_rollup', db.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('minute', DateTime, nullable=False),
+            Column('user_id', Integer, nullable=False),
+            Column('action', String(50), nullable=False),
+            Column('count', Integer, nullable=False),
+            UniqueConstraint('minute', 'user_id', 'action', name='uq_audit_rollup_minute_user_action'),
+        )
+        self.model = type('AuditRollup', (db.Model,), {'__table__': self.table})
+        atexit.register(self._flush_at_exit)
+
+        @app.cli.command('audit-totals')
+        @click.option('--since', type=click.DateTime(), help='Only events at or after this time.')
+        @click.option('--until', type=click.DateTime(), help='Only events before this time.')
+        def audit_totals_command(since, until):
+            """Print the exact number of audited events per action."""
+            self.flush()
+            for action, total in sorted(self.totals(since, until).items()):
+                click.echo(f'{total:>10}  {action}')
+
+    def record(self, user_id, action, write_full):
+        """Apply the action's policy to one read event; write_full() logs it in full."""
+        policy = self.app.config['AUDIT_POLICIES'].get(action, {'mode': 'full'})
+        mode = policy['mode']
+        if mode == 'full' or (mode == 'sample' and random.random() < policy.get('rate', 0.01)):
+            write_full()
+        else:
+            minute = datetime.utcnow().replace(second=0, microsecond=0)
+            with self.lock:
+                key = (minute, user_id, action)
+                self.pending[key] = self.pending.get(key, 0) + 1
+                if self.flusher is None or not self.flusher.is_alive():
+                    self.flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+                    self.flusher.start()
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(self.app.config['AUDIT_ROLLUP_FLUSH_SECONDS'])
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                # The counts were put back and are retried on the next flush
+                self.app.logger.exception('Could not flush audit rollups')
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            with self.db.engine.begin() as conn:
+                for (minute, user_id, action), count in pending.items():
+                    stmt = insert(self.table).values(minute=minute, user_id=user_id, action=action, count=count)
+                    conn.execute(stmt.on_conflict_do_update(
+                        index_elements=['minute', 'user_id', 'action'],
+                        set_={'count': self.table.c.count + count}))
+        except Exception:
+            # Put the counts back so the next flush retries them
+            with self.lock:
+                for key, count in pending.items():
+                    self.pending[key] = self.pending.get(key, 0) + count
+            raise
+
+    def _flush_at_exit(self):
+        with self.app.app_context():
+            self.flush()
+
+    def totals(self, since=None, until=None):
+        """Exact event count per action: full rows plus rolled-up counters.
+
+        Rolled-up counters have minute resolution, so since/until are applied
+        to them by minute.
+        """
+        audit, rollup = self.audit_model, self.table
+        full = self.db.session.query(audit.action, func.count(audit.id))
+        counted = select(rollup.c.action, func.sum(rollup.c.count))
+        if since:
+            full = full.filter(audit.timestamp >= since)
+            counted = counted.where(rollup.c.minute >= since.replace(second=0, microsecond=0))
+        if until:
+            full = full.filter(audit.timestamp < until)
+            counted = counted.where(rollup.c.minute < until)
+        totals = dict(full.group_by(audit.action).all())
+        for action, count in self.db.session.execute(counted.group_by(rollup.c.action)):
+            totals[action] = totals.get(action, 0) + count
+        return totals
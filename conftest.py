@@ -0,0 +1,63 @@
+import base64
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The apps read their database URI at import time, so point them at a scratch
+# directory before any test imports them
+_db_dir = tempfile.mkdtemp(prefix='lms-tests-')
+os.environ.setdefault('LMS_DATABASE_URI', f'sqlite:///{_db_dir}/courses.db')
+os.environ.setdefault('LMS2_DATABASE_URI', f'sqlite:///{_db_dir}/courses2.db')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'new_version'))
+
+# Scripts that drive a server already running on localhost:5000
+collect_ignore = ['test_lms_api.py', 'test_rate_limit.py']
+
+PERMISSIONS = ['view_courses', 'view_course', 'create_course', 'update_course', 'delete_course', 'export_data',
+               'import_courses', 'view_slow_queries', 'view_metrics', 'manage_jobs']
+
+@pytest.fixture
+def lms(tmp_path):
+    """The app module with empty tables, an 'admin' user with every permission
+    and an 'instructor' user who can only read courses (both with password 'pw')."""
+    import app as lms
+    lms.app.config.update(TESTING=True, EXPORT_DIR=str(tmp_path / 'exports'))
+    lms.bcrypt._log_rounds = 4
+    lms.limiter.enabled = False
+    with lms.app.app_context():
+        lms.db.drop_all()
+        lms.db.create_all()
+        permissions = [lms.Permission(name=name) for name in PERMISSIONS]
+        lms.db.session.add_all([lms.Role(name='admin', permissions=permissions),
+                                lms.Role(name='instructor', permissions=permissions[:2])])
+        for username in ('admin', 'instructor'):
+            password_hash = lms.bcrypt.generate_password_hash('pw').decode('utf-8')
+            lms.db.session.add(lms.User(username=username, password_hash=password_hash, role=username))
+        lms.db.session.commit()
+    lms.audit_policy.pending.clear()
+    yield lms
+    lms.limiter.reset()
+
+def basic_auth(username='admin'):
+    return {'Authorization': 'Basic ' + base64.b64encode(f'{username}:pw'.encode()).decode()}
+
+@pytest.fixture
+def auth():
+    """auth(username) returns the Basic auth header of a user created by the lms fixture."""
+    return basic_auth
+
+@pytest.fixture
+def lms2():
+    """The new_version app module with empty tables."""
+    import app2_final_version as lms2
+    lms2.app.config.update(TESTING=True, JWT_VERIFY_SUB=False)
+    lms2.bcrypt._log_rounds = 4
+    lms2.limiter.enabled = False
+    with lms2.app.app_context():
+        lms2.db.drop_all()
+        lms2.db.create_all()
+    lms2.audit_policy.pending.clear()
+    yield lms2
+    lms2.limiter.reset()
@@ -0,0 +1,95 @@
+import csv
+import json
+import time
+
+from marshmallow import ValidationError
+from sqlalchemy import tuple_
+
+FORMATS = ('csv', 'jsonl')
+
+# Streaming bulk import of courses.
+# Rows are parsed one at a time, validated with the course schema and upserted
+# in chunks keyed on (title, instructor), one transaction per chunk. Upserts go
+# through the ORM so session listeners (course statistics) see every change.
+
+def iter_rows(stream, fmt):
+    """Yield (line, row, error) for every record of a text stream."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Empty cells mean "not provided", so optional fields fall back to their defaults
+            yield reader.line_num, {k: v for k, v in row.items() if k is not None and v != ''}, None
+    elif fmt == 'jsonl':
+        for line, text in enumerate(stream, start=1):
+            if not text.strip():
+                continue
+            try:
+                row = json.loads(text)
+            except ValueError as e:
+                yield line, text.rstrip('\n'), {'_row': [f'Invalid JSON: {e}']}
+                continue
+            if not isinstance(row, dict):
+                yield line, row, {'_row': ['Expected a JSON object']}
+                continue
+            yield line, row, None
+    else:
+        raise ValueError(f'Unsupported import format: {fmt}')
+
+def _upsert_chunk(session, model, chunk):
+    keys = list(chunk)
+    existing = {(c.title, c.instructor): c
+                for c in model.query.filter(tuple_(model.title, model.instructor).in_(keys))}
+    inserted = updated = 0
+    for key, data in chunk.items():
+        course = existing.get(key)
+        if course is None:
+            session.add(model(**data))
+            inserted += 1
+        else:
+            for field, value in data.items():
+                setattr(course, field, value)
+            updated += 1
+    session.commit()
+    return inserted, updated
+
+def import_courses(session, model, schema, rows, chunk_size=500, on_reject=None, progress=None):
+    """Validate and upsert rows from iter_rows.
+
+    on_reject(line, row, errors) is called for every invalid row and
+    progress(result) after every committed chunk. Returns a dict with the
+    inserted/updated/rejected counts, elapsed seconds and rows per second.
+    """
+    result = {'inserted': 0, 'updated': 0, 'rejected': 0}
+    started = time.monotonic()
+    chunk = {}
+
+    def flush():
+        inserted, updated = _upsert_chunk(session, model, chunk)
+        result['inserted'] += inserted
+        result['updated'] += updated
+        chunk.clear()
+        result['seconds'] = time.monotonic() - started
+        result['rows_per_second'] = (result['inserted'] + result['updated'] + result['rejected']) / max(result['seconds'], 1e-9)
+
+    for line, row, errors in rows:
+        if errors is None:
+            try:
+                data = schema.load(row)
+            except ValidationError as e:
+                errors = e.messages
+        if errors is not None:
+            result['rejected'] += 1
+            if on_reject:
+                on_reject(line, row, errors)
+            continue
+        # A later row with the same natural key in the same chunk replaces the earlier one
+        key = (data['title'], data['instructor'])
+        if key in chunk:
+            result['updated'] += 1
+        chunk[key] = data
+        if len(chunk) >= chunk_size:
+            flush()
+            if progress:
+                progress(result)
+    flush()
+    return result
@@ -62,7 +62,7 @@ def populate_db():
         db.session.commit()
 
         # Crear permisos si no existen
-        permissions = ['view_courses', 'view_course', 'create_course', 'update_course', 'delete_course']
+        permissions = ['view_courses', 'view_course', 'create_course', 'update_course', 'delete_course', 'export_data', 'import_courses', 'view_slow_queries', 'view_metrics', 'manage_jobs']
         for perm_name in permissions:
             perm = Permission.query.filter_by(name=perm_name).first()
             if not perm:
@@ -0,0 +1,129 @@
+import csv
+import gzip
+import io
+import json
+import os
+import time
+import zlib
+from datetime import datetime
+
+from sqlalchemy import select
+
+FORMATS = ('csv', 'jsonl')
+MIMETYPES = {'csv': 'text/csv', 'jsonl': 'application/x-ndjson'}
+
+# Streaming exports of whole tables to CSV/JSONL.
+# Rows are read in id order with a keyset (id > last_id) so an interrupted export
+# can resume from the last id written, and memory stays bounded by batch_size.
+
+def iter_records(session, model, filters=(), after_id=0, batch_size=1000):
+    columns = model.__table__.columns.keys()
+    stmt = (select(*[getattr(model, c) for c in columns])
+            .where(model.id > after_id, *filters)
+            .order_by(model.id)
+            .execution_options(yield_per=batch_size))
+    for row in session.execute(stmt):
+        yield dict(zip(columns, row))
+
+def _serialize(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def format_header(fmt, columns):
+    if fmt != 'csv':
+        return ''
+    return format_record(fmt, columns, dict(zip(columns, columns)))
+
+def format_record(fmt, columns, record):
+    if fmt == 'jsonl':
+        return json.dumps({c: _serialize(record[c]) for c in columns}) + '\n'
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator='\n').writerow([_serialize(record[c]) for c in columns])
+    return buffer.getvalue()
+
+def iter_chunks(records, fmt, columns, header=True, batch_size=1000):
+    """Yield the export as text chunks of batch_size rows."""
+    lines = [format_header(fmt, columns)] if header else []
+    for record in records:
+        lines.append(format_record(fmt, columns, record))
+        if len(lines) >= batch_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+def gzip_chunks(chunks):
+    """Compress a stream of text chunks into a single gzip member."""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def read_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+def write_checkpoint(path, arguments, last_id, rows, offset):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'arguments': arguments, 'last_id': last_id, 'rows': rows, 'offset': offset}, f)
+    os.replace(tmp_path, path)
+
+def export_to_file(session, model, output, fmt='csv', compress=False, filters=(), options=None,
+                   checkpoint=None, batch_size=1000, progress=None):
+    """Stream model rows to output, resuming from checkpoint if one exists.
+
+    Every batch is written as a whole (a complete gzip member when compressing)
+    and the checkpoint records the last id and the file offset after it. On
+    resume the file is truncated back to that offset, so rows from a partly
+    written batch are never duplicated. options holds the JSON-serializable
+    arguments behind filters; they are stored in the checkpoint with the table,
+    output, format and compression, and a checkpoint written with different
+    arguments raises ValueError instead of being resumed. Returns (rows, seconds)
+    for this run.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f'Unsupported export format: {fmt}')
+    columns = model.__table__.columns.keys()
+    arguments = {'table': model.__tablename__, 'output': os.path.abspath(output),
+                 'format': fmt, 'gzip': compress, **(options or {})}
+
+    state = read_checkpoint(checkpoint)
+    if state is not None and state.get('arguments') != arguments:
+        raise ValueError(f'Checkpoint {checkpoint} belongs to a different export ({state.get("arguments")}); '
+                         'use the same arguments to resume it or remove the checkpoint')
+    resuming = state is not None and os.path.exists(output)
+    last_id = state['last_id'] if resuming else 0
+    total = state['rows'] if resuming else 0
+
+    rows = 0
+    started = time.monotonic()
+    with open(output, 'r+b' if resuming else 'wb') as f:
+        if resuming:
+            f.truncate(state['offset'])
+            f.seek(state['offset'])
+        lines = [] if resuming else [format_header(fmt, columns)]
+
+        def flush_batch():
+            data = ''.join(lines).encode('utf-8')
+            f.write(gzip.compress(data) if compress else data)
+            f.flush()
+            lines.clear()
+            if checkpoint:
+                write_checkpoint(checkpoint, arguments, last_id, total + rows, f.tell())
+
+        for record in iter_records(session, model, filters, last_id, batch_size):
+            lines.append(format_record(fmt, columns, record))
+            last_id = record['id']
+            rows += 1
+            if rows % batch_size == 0:
+                flush_batch()
+                if progress:
+                    progress(total + rows, rows / max(time.monotonic() - started, 1e-9))
+        flush_batch()
+    return rows, time.monotonic() - started
@@ -0,0 +1,218 @@
+import json
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import Column, DateTime, Float, Integer, String, Table, Text, and_, func, select
+
+# Local background job queue.
+# Jobs are rows in the app's SQLite database. Request handlers enqueue them and
+# answer 202; a separate process started with "flask run-jobs" claims queued jobs
+# and runs them on a pool of worker threads. Failed jobs are retried with
+# exponential backoff up to max_attempts, and each job type can cap how many of
+# its jobs run at once across all workers. While a job runs, its worker records a
+# heartbeat every JOBS_HEARTBEAT_INTERVAL seconds; jobs whose heartbeat is older
+# than JOBS_STALE_AFTER (their worker died) are requeued when workers start.
+
+QUEUED, RUNNING, SUCCEEDED, FAILED = 'queued', 'running', 'succeeded', 'failed'
+
+# Raised by handlers for a payload they cannot process; retrying would fail the same way
+PERMANENT_ERRORS = (KeyError, ValueError)
+
+class JobQueue:
+    def __init__(self, app=None, db=None):
+        self.handlers = {}
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('JOBS_WORKERS', 4)
+        app.config.setdefault('JOBS_POLL_INTERVAL', 1.0)
+        app.config.setdefault('JOBS_RETRY_BACKOFF', 5)  # Seconds before the first retry, doubled on each attempt
+        app.config.setdefault('JOBS_MAX_BACKOFF', 600)
+        app.config.setdefault('JOBS_STALE_AFTER', 300)  # Running jobs without a heartbeat for this long are requeued
+        app.config.setdefault('JOBS_HEARTBEAT_INTERVAL', 30)
+        self.app = app
+        self.db = db
+        self.table = Table(
+            'job', db.metadata,
+            Column('id', Integer, primary_key=True),
+            Column('type', String(50), nullable=False),
+            Column('payload', Text, nullable=False),
+            Column('status', String(20), nullable=False, default=QUEUED, index=True),
+            Column('attempts', Integer, nullable=False, default=0),
+            Column('max_attempts', Integer, nullable=False),
+            Column('run_at', DateTime, nullable=False),
+            Column('progress', Float, nullable=False, default=0.0),
+            Column('message', String(500)),
+            Column('result', Text),
+            Column('error', Text),
+            Column('created_at', DateTime, nullable=False),
+            Column('started_at', DateTime),
+            Column('finished_at', DateTime),
+            Column('heartbeat_at', DateTime),
+        )
+
+        @app.cli.command('run-jobs')
+        @click.option('--workers', type=int, help='Number of worker threads.')
+        def run_jobs_command(workers):
+            """Run queued background jobs until interrupted."""
+            self.run_workers(workers or app.config['JOBS_WORKERS'])
+
+    def handler(self, job_type, max_concurrency=None, max_attempts=3, validate=None):
+        """Register fn(payload, progress) as the handler of job_type.
+
+        progress(fraction, message=None) records how far the job got. The
+        handler's return value is stored as the job result. validate(payload),
+        if given, is called by enqueue and returns the payload to store or
+        raises ValueError, so bad payloads are refused before they are queued.
+        """
+        def decorator(fn):
+            self.handlers[job_type] = {'fn': fn, 'max_concurrency': max_concurrency, 'max_attempts': max_attempts,
+                                       'validate': validate}
+            return fn
+        return decorator
+
+    def enqueue(self, job_type, payload=None):
+        """Add a job in the current session's transaction and commit. Returns the job id.
+
+        Raises ValueError for an unknown job type or a payload its validator refuses.
+        """
+        if job_type not in self.handlers:
+            raise ValueError(f'Unknown job type: {job_type}')
+        payload = payload or {}
+        validate = self.handlers[job_type]['validate']
+        if validate is not None:
+            payload = validate(payload)
+        now = datetime.utcnow()
+        result = self.db.session.execute(self.table.insert().values(
+            type=job_type, payload=json.dumps(payload), status=QUEUED, attempts=0,
+            max_attempts=self.handlers[job_type]['max_attempts'], run_at=now, progress=0.0, created_at=now))
+        self.db.session.commit()
+        return result.inserted_primary_key[0]
+
+    def get(self, job_id):
+        row = self.db.session.execute(select(self.table).where(self.table.c.id == job_id)).mappings().first()
+        if row is None:
+            return None
+        job = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row.items()}
+        job['payload'] = json.loads(job['payload'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def _update(self, job_id, **values):
+        with self.db.engine.begin() as conn:
+            conn.execute(self.table.update().where(self.table.c.id == job_id).values(**values))
+
+    def requeue_stale(self):
+        stale = datetime.utcnow() - timedelta(seconds=self.app.config['JOBS_STALE_AFTER'])
+        with self.db.engine.begin() as conn:
+            return conn.execute(self.table.update()
+                                .where(self.table.c.status == RUNNING, self.table.c.heartbeat_at < stale)
+                                .values(status=QUEUED, run_at=datetime.utcnow())).rowcount
+
+    def claim(self):
+        """Atomically move one runnable job to running, respecting per-type limits."""
+        job = self.table
+        now = datetime.utcnow()
+        with self.db.engine.begin() as conn:
+            candidates = conn.execute(
+                select(job.c.id, job.c.type)
+                .where(job.c.status == QUEUED, job.c.run_at <= now, job.c.type.in_(list(self.handlers)))
+                .order_by(job.c.run_at, job.c.id).limit(20)).all()
+        for job_id, job_type in candidates:
+            conditions = [job.c.id == job_id, job.c.status == QUEUED]
+            limit = self.handlers[job_type]['max_concurrency']
+            if limit is not None:
+                running = (select(func.count()).select_from(job)
+                           .where(job.c.type == job_type, job.c.status == RUNNING).scalar_subquery())
+                conditions.append(running < limit)
+            # A single UPDATE, so two workers can never claim the same job or exceed the type limit
+            with self.db.engine.begin() as conn:
+                claimed = conn.execute(job.update().where(and_(*conditions)).values(
+                    status=RUNNING, attempts=job.c.attempts + 1, started_at=now,
+                    heartbeat_at=now, error=None)).rowcount
+            if claimed:
+                return job_id
+        return None
+
+    def _heartbeat(self, job_id, done):
+        # Keeps a long job without progress() calls from looking stale while it still runs
+        with self.app.app_context():
+            while not done.wait(self.app.config['JOBS_HEARTBEAT_INTERVAL']):
+                try:
+                    self._update(job_id, heartbeat_at=datetime.utcnow())
+                except Exception:
+                    self.app.logger.exception('Could not record the heartbeat of job %s', job_id)
+
+    def run_job(self, job_id):
+        with self.app.app_context():
+            row = self.db.session.execute(select(self.table).where(self.table.c.id == job_id)).mappings().one()
+            handler = self.handlers[row['type']]
+
+            def progress(fraction, message=None):
+                self._update(job_id, progress=fraction, message=message, heartbeat_at=datetime.utcnow())
+
+            done = threading.Event()
+            heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, done), daemon=True)
+            heartbeat.start()
+            try:
+                result = handler['fn'](json.loads(row['payload']), progress)
+            except Exception as e:
+                self.db.session.rollback()
+                error = traceback.format_exc()
+                self.app.logger.error('Job %s (%s) failed on attempt %s:\n%s', job_id, row['type'], row['attempts'], error)
+                if row['attempts'] < row['max_attempts'] and not isinstance(e, PERMANENT_ERRORS):
+                    backoff = min(self.app.config['JOBS_RETRY_BACKOFF'] * 2 ** (row['attempts'] - 1),
+                                  self.app.config['JOBS_MAX_BACKOFF'])
+                    self._update(job_id, status=QUEUED, error=error,
+                                 run_at=datetime.utcnow() + timedelta(seconds=backoff))
+                else:
+                    self._update(job_id, status=FAILED, error=error, finished_at=datetime.utcnow())
+                return
+            finally:
+                done.set()
+                heartbeat.join()
+                self.db.session.remove()
+            self._update(job_id, status=SUCCEEDED, progress=1.0, result=json.dumps(result),
+                         finished_at=datetime.utcnow())
+
+    def work(self, stop):
+        errors = 0
+        with self.app.app_context():
+            while not stop.is_set():
+                try:
+                    job_id = self.claim()
+                    if job_id is not None:
+                        self.run_job(job_id)
+                    errors = 0
+                except Exception:
+                    # e.g. "database is locked": keep the worker alive and back off before polling again
+                    errors += 1
+                    delay = min(self.app.config['JOBS_POLL_INTERVAL'] * 2 ** errors, self.app.config['JOBS_MAX_BACKOFF'])
+                    self.app.logger.exception('Job worker error, retrying in %.1fs', delay)
+                    stop.wait(delay)
+                    continue
+                if job_id is None:
+                    stop.wait(self.app.config['JOBS_POLL_INTERVAL'])
+
+    def run_workers(self, workers):
+        self.db.create_all()
+        requeued = self.requeue_stale()
+        if requeued:
+            click.echo(f'Requeued {requeued} stale jobs')
+        stop = threading.Event()
+        threads = [threading.Thread(target=self.work, args=(stop,), daemon=True) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        click.echo(f'Running jobs with {workers} workers ({", ".join(sorted(self.handlers))})')
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            click.echo('Stopping workers after their current job')
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -1,10 +1,23 @@
 from flask import Flask, request, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import JWTManager, create_access_token, create_refresh_token, decode_token, jwt_required, get_jwt_identity, get_jwt
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from datetime import datetime, timedelta
+from werkzeug.exceptions import HTTPException, MethodNotAllowed
+import os
+import sys
+import threading
+import time
+
+# Los módulos compartidos por ambas aplicaciones (slow_queries, ...) están en la raíz del proyecto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from admission import AdmissionControl
+from audit_policy import AuditPolicy
+from jobs import JobQueue
+from course_suggest import PrefixIndex
+from slow_queries import SlowQueryLog
 
 app = Flask(__name__)
 
@@ -16,9 +29,36 @@ def index():
     return render_template('index.html')
 
 # Configuración de la base de datos
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///courses2.db'
+# LMS2_DATABASE_URI permite usar otra base de datos (por ejemplo, una temporal en las pruebas)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('LMS2_DATABASE_URI', 'sqlite:///courses2.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['JWT_SECRET_KEY'] = 'your_jwt_secret_key'  # Cambia esto por una clave secreta segura
+# Tokens de acceso cortos; el cliente obtiene nuevos con /refresh sin volver a pasar por bcrypt
+app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(minutes=15)
+app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=30)
+# Cada cuántos segundos se eliminan de la lista de revocados los tokens ya expirados
+app.config['TOKEN_BLOCKLIST_PURGE_SECONDS'] = 3600
+
+# Control de admisión: las lecturas baratas se descartan al final, el hashing de contraseñas y las escrituras primero
+app.config['ADMISSION_PRIORITIES'] = {
+    'get_courses': 'high', 'get_course': 'high', 'suggest_courses': 'high',
+    'login': 'low', 'register': 'low',
+    'create_course': 'low', 'update_course': 'low', 'delete_course': 'low',
+}
+app.config['ADMISSION_ROUTE_LIMITS'] = {'login': 4, 'register': 2}
+app.config['ADMISSION_EXEMPT'] = ['static', 'get_admission_stats']
+
+# Cada worker tiene su propio índice de autocompletado; se reconstruye cada tanto
+# para recoger los cambios hechos por otros workers
+app.config['SUGGEST_REFRESH_SECONDS'] = 60
+
+# Política de auditoría: las lecturas se muestrean o se acumulan en contadores por minuto;
+# las escrituras y los eventos de autenticación siempre se registran completos
+app.config['AUDIT_POLICIES'] = {
+    'Courses Retrieved': {'mode': 'rollup'},
+    'Course Retrieved': {'mode': 'sample', 'rate': 0.01},
+    'Access Protected Route': {'mode': 'rollup'},
+}
 
 db = SQLAlchemy(app)
 bcrypt = Bcrypt(app)
@@ -31,6 +71,15 @@ limiter = Limiter(
     default_limits=["200 per day", "50 per hour"]
 )
 
+# Registro de consultas lentas (umbral configurable con SLOW_QUERY_THRESHOLD_MS)
+slow_queries = SlowQueryLog(app, db)
+
+# Límites de concurrencia y cola de espera por ruta (503 con Retry-After si se supera)
+admission = AdmissionControl(app)
+
+# Cola de trabajos en segundo plano (se ejecutan con "flask run-jobs" en un proceso aparte)
+jobs = JobQueue(app, db)
+
 # Modelos
 class Role(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -58,12 +107,105 @@ class AuditLog(db.Model):
     details = db.Column(db.String(500))
     ip_address = db.Column(db.String(100))
 
+# Lista de tokens revocados (compartida entre workers a través de SQLite).
+# El jti es la clave primaria, así que la consulta en cada petición es una búsqueda por índice.
+class TokenBlocklist(db.Model):
+    jti = db.Column(db.String(36), primary_key=True)
+    token_type = db.Column(db.String(10), nullable=False)
+    expires = db.Column(db.DateTime, nullable=False, index=True)
+
+# Comprobación de revocación en cada ruta protegida con @jwt_required
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    # Un token de acceso también queda revocado cuando se revoca el refresh token de su sesión
+    jtis = [jwt_payload['jti']] + ([jwt_payload['refresh_jti']] if 'refresh_jti' in jwt_payload else [])
+    return TokenBlocklist.query.filter(TokenBlocklist.jti.in_(jtis)).first() is not None
+
+# Elimina las entradas cuyo token ya expiró: un token expirado es rechazado de todas formas
+def purge_expired_tokens():
+    TokenBlocklist.query.filter(TokenBlocklist.expires < datetime.utcnow()).delete()
+
+# La purga corre en un hilo por worker, iniciado con la primera petición que atiende
+token_purger = None
+token_purger_lock = threading.Lock()
+
+def purge_expired_tokens_periodically():
+    while True:
+        time.sleep(app.config['TOKEN_BLOCKLIST_PURGE_SECONDS'])
+        try:
+            with app.app_context():
+                purge_expired_tokens()
+                db.session.commit()
+        except Exception:
+            # Se reintenta en la siguiente vuelta
+            app.logger.exception('Could not purge expired revoked tokens')
+
+@app.before_request
+def start_token_purger():
+    global token_purger
+    if token_purger is not None and token_purger.is_alive():
+        return
+    with token_purger_lock:
+        if token_purger is None or not token_purger.is_alive():
+            token_purger = threading.Thread(target=purge_expired_tokens_periodically, daemon=True)
+            token_purger.start()
+
+# Revoca un token a partir de su payload decodificado
+def revoke_token(jti, token_type, expires_at):
+    if TokenBlocklist.query.get(jti) is None:
+        db.session.add(TokenBlocklist(jti=jti, token_type=token_type, expires=datetime.utcfromtimestamp(expires_at)))
+    db.session.commit()
+
+# Los tokens de acceso llevan el jti y la expiración del refresh token de su sesión,
+# para que cerrar sesión con el token de acceso revoque también el refresh token
+def create_session_access_token(identity, refresh_jti, refresh_exp):
+    return create_access_token(identity=identity, additional_claims={"refresh_jti": refresh_jti, "refresh_exp": refresh_exp})
+
+# Índice de autocompletado de títulos e instructores
+course_index = PrefixIndex()
+course_index_built_at = None
+# Solo un hilo reconstruye el índice; mientras tanto las peticiones siguen usando el anterior
+course_index_refresh = threading.Lock()
+
+def refresh_course_index():
+    global course_index_built_at
+    with app.app_context():
+        course_index.build(db.session.query(Course.id, Course.title, Course.instructor))
+    course_index_built_at = time.monotonic()
+
+def refresh_course_index_in_background():
+    try:
+        refresh_course_index()
+    except Exception:
+        # Se reintenta en la siguiente petición
+        app.logger.exception('Could not refresh the course suggestion index')
+    finally:
+        course_index_refresh.release()
+
+def get_course_index():
+    if course_index_built_at is None:
+        # Primera construcción: las peticiones concurrentes esperan a que termine una sola
+        with course_index_refresh:
+            if course_index_built_at is None:
+                refresh_course_index()
+    elif (time.monotonic() - course_index_built_at > app.config['SUGGEST_REFRESH_SECONDS']
+          and course_index_refresh.acquire(blocking=False)):
+        threading.Thread(target=refresh_course_index_in_background, daemon=True).start()
+    return course_index
+
 # Función auxiliar para registrar logs
 def register_audit_log(user_id, action, details, ip_address):
     audit_log = AuditLog(user_id=user_id, action=action, details=details, ip_address=ip_address)
     db.session.add(audit_log)
     db.session.commit()
 
+# Contadores agregados de las lecturas (count(audit_log) + sum(audit_rollup.count) da el total exacto)
+audit_policy = AuditPolicy(app, db, AuditLog)
+
+# Registra un evento de lectura según la política de su acción
+def register_read_audit_log(user_id, action, details, ip_address):
+    audit_policy.record(user_id, action, lambda: register_audit_log(user_id, action, details, ip_address))
+
 # Ruta para registrar usuarios con rol
 @app.route('/register', methods=['POST'])
 def register():
@@ -99,14 +241,46 @@ def login():
     if not user or not bcrypt.check_password_hash(user.password_hash, password):
         return jsonify({"msg": "Bad username or password"}), 401
 
-    # Crear un token JWT que incluye el rol del usuario
-    access_token = create_access_token(identity={"username": user.username, "role": user.role})
+    # Crear un token JWT que incluye el rol del usuario, y un refresh token para renovarlo
+    identity = {"username": user.username, "role": user.role}
+    refresh_token = create_refresh_token(identity=identity)
+    refresh_payload = decode_token(refresh_token)
+    access_token = create_session_access_token(identity, refresh_payload['jti'], refresh_payload['exp'])
 
     # Registrar el evento de login en el log
     register_audit_log(user.id, "User Login", f"User '{username}' logged in", request.remote_addr)
 
+    return jsonify(access_token=access_token, refresh_token=refresh_token, role=user.role)
+
+# Ruta para obtener un nuevo token de acceso a partir del refresh token
+@app.route('/refresh', methods=['POST'])
+@jwt_required(refresh=True)
+def refresh():
+    # El rol se vuelve a leer de la base de datos: puede haber cambiado desde el login
+    user = User.query.filter_by(username=get_jwt_identity()['username']).first()
+    if not user:
+        return jsonify({"msg": "User no longer exists"}), 401
+
+    token = get_jwt()
+    identity = {"username": user.username, "role": user.role}
+    access_token = create_session_access_token(identity, token['jti'], token['exp'])
     return jsonify(access_token=access_token, role=user.role)
 
+# Ruta para cerrar sesión: revoca el token enviado y, si es de acceso, el refresh token de su sesión
+@app.route('/logout', methods=['DELETE'])
+@jwt_required(verify_type=False)
+def logout():
+    token = get_jwt()
+    revoke_token(token['jti'], token['type'], token['exp'])
+    if 'refresh_jti' in token:
+        revoke_token(token['refresh_jti'], 'refresh', token['refresh_exp'])
+
+    current_user = get_jwt_identity()
+    user = User.query.filter_by(username=current_user['username']).first()
+    register_audit_log(user.id, "Token Revoked", f"{token['type'].capitalize()} token revoked", request.remote_addr)
+
+    return jsonify({"msg": f"{token['type'].capitalize()} token revoked"}), 200
+
 
 # Ruta protegida de ejemplo
 @app.route('/protected', methods=['GET'])
@@ -116,7 +290,7 @@ def protected():
     user = User.query.filter_by(username=current_user['username']).first()
     
     # Registrar el acceso a la ruta protegida
-    register_audit_log(user.id, "Access Protected Route", f"User accessed protected route", request.remote_addr)
+    register_read_audit_log(user.id, "Access Protected Route", f"User accessed protected route", request.remote_addr)
     
     return jsonify(logged_in_as=current_user), 200
 
@@ -145,6 +319,7 @@ def create_course():
     )
     db.session.add(new_course)
     db.session.commit()
+    course_index.add(new_course)
 
     user = User.query.filter_by(username=current_user['username']).first()
     register_audit_log(user.id, "Course Created", f"Course '{title}' created", request.remote_addr)
@@ -167,10 +342,23 @@ def get_courses():
 
     current_user = get_jwt_identity()
     user = User.query.filter_by(username=current_user['username']).first()
-    register_audit_log(user.id, "Courses Retrieved", "User retrieved all courses", request.remote_addr)
+    register_read_audit_log(user.id, "Courses Retrieved", "User retrieved all courses", request.remote_addr)
 
     return jsonify(courses_list), 200
 
+# Autocompletar títulos e instructores (accesible para todos los roles).
+# Se responde desde el índice en memoria, sin consultar los cursos ni registrar en el log.
+@app.route('/courses/suggest', methods=['GET'])
+@jwt_required()
+@limiter.limit("600 per minute")
+def suggest_courses():
+    field = request.args.get('field')
+    if field not in (None, 'title', 'instructor'):
+        return jsonify({"msg": "field must be 'title' or 'instructor'"}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), 20))
+    suggestions = get_course_index().suggest(request.args.get('q', ''), limit=limit, field=field)
+    return jsonify(suggestions), 200
+
 # Leer un solo curso por ID (accesible para todos los roles)
 @app.route('/courses/<int:course_id>', methods=['GET'])
 @jwt_required()
@@ -183,7 +371,7 @@ def get_course(course_id):
     # Registrar el evento en el log
     current_user = get_jwt_identity()
     user = User.query.filter_by(username=current_user['username']).first()
-    register_audit_log(user.id, "Course Retrieved", f"User retrieved course '{course.title}'", request.remote_addr)
+    register_read_audit_log(user.id, "Course Retrieved", f"User retrieved course '{course.title}'", request.remote_addr)
 
     return jsonify({
         "id": course.id,
@@ -194,6 +382,87 @@ def get_course(course_id):
         "enrollment_limit": course.enrollment_limit
     }), 200
 
+# Lecturas de cursos por lotes (accesible para todos los roles).
+# Hasta BATCH_MAX_SIZE lecturas en una sola petición: un solo token, una consulta
+# para todos los ids pedidos y una sola entrada en el log.
+BATCH_MAX_SIZE = 50
+BATCH_ENDPOINTS = ('get_courses', 'get_course')
+
+def course_to_dict(course):
+    return {
+        "id": course.id,
+        "title": course.title,
+        "description": course.description,
+        "instructor": course.instructor,
+        "duration": course.duration,
+        "enrollment_limit": course.enrollment_limit
+    }
+
+def batch_cost():
+    # Cada sub-petición cuenta como una petición para el límite del lote
+    sub_requests = (request.get_json(silent=True) or {}).get('requests')
+    return max(len(sub_requests), 1) if isinstance(sub_requests, list) else 1
+
+@app.route('/batch', methods=['POST'])
+@jwt_required()
+@limiter.limit("60 per minute", cost=batch_cost)
+def batch():
+    data = request.get_json(silent=True) or {}
+    sub_requests = data.get('requests')
+    if not isinstance(sub_requests, list) or not sub_requests:
+        return jsonify({"msg": "'requests' must be a non-empty list"}), 400
+    if len(sub_requests) > BATCH_MAX_SIZE:
+        return jsonify({"msg": f"A batch can hold at most {BATCH_MAX_SIZE} requests"}), 400
+
+    # Se resuelven todas las rutas antes de consultar la base de datos
+    urls = app.url_map.bind('')
+    resolved = []
+    for sub_request in sub_requests:
+        if not isinstance(sub_request, dict) or not isinstance(sub_request.get('path'), str):
+            resolved.append((400, {"msg": "Each request needs a 'path'"}))
+            continue
+        method = sub_request.get('method', 'GET')
+        if not isinstance(method, str):
+            resolved.append((400, {"msg": "'method' must be a string"}))
+            continue
+        try:
+            endpoint, args = urls.match(sub_request['path'], method.upper())
+        except MethodNotAllowed:
+            resolved.append((405, {"msg": "Method not allowed"}))
+            continue
+        except HTTPException:
+            resolved.append((404, {"msg": "Not found"}))
+            continue
+        if endpoint not in BATCH_ENDPOINTS:
+            resolved.append((400, {"msg": "Only course reads can be batched"}))
+            continue
+        resolved.append((endpoint, args))
+
+    course_ids = {args['course_id'] for endpoint, args in resolved if endpoint == 'get_course'}
+    courses = {c.id: c for c in Course.query.filter(Course.id.in_(course_ids))} if course_ids else {}
+    all_courses = None
+    if any(endpoint == 'get_courses' for endpoint, _ in resolved):
+        all_courses = [course_to_dict(course) for course in Course.query.all()]
+
+    responses = []
+    for endpoint, args in resolved:
+        if endpoint not in BATCH_ENDPOINTS:
+            responses.append({"status": endpoint, "body": args})
+        elif endpoint == 'get_courses':
+            responses.append({"status": 200, "body": all_courses})
+        elif args['course_id'] in courses:
+            responses.append({"status": 200, "body": course_to_dict(courses[args['course_id']])})
+        else:
+            responses.append({"status": 404, "body": {"msg": "Course not found"}})
+
+    current_user = get_jwt_identity()
+    user = User.query.filter_by(username=current_user['username']).first()
+    register_read_audit_log(user.id, "Batch Retrieved",
+                            f"Batch of {len(sub_requests)} requests, course ids: {sorted(course_ids)}"[:500],
+                            request.remote_addr)
+
+    return jsonify({"responses": responses}), 200
+
 # Actualizar un curso (solo para admin o editor)
 @app.route('/courses/<int:course_id>', methods=['PUT'])
 @jwt_required()
@@ -216,6 +485,7 @@ def update_course(course_id):
     course.enrollment_limit = data.get('enrollment_limit', course.enrollment_limit)
 
     db.session.commit()
+    course_index.add(course)
 
     user = User.query.filter_by(username=current_user['username']).first()
     register_audit_log(user.id, "Course Updated", f"Course '{course.title}' updated", request.remote_addr)
@@ -236,16 +506,125 @@ def delete_course(course_id):
     if not course:
         return jsonify({"msg": "Course not found"}), 404
 
+    user = User.query.filter_by(username=current_user['username']).first()
+
+    # Con ?async=true la eliminación se encola y se responde 202 sin esperar
+    if request.args.get('async', 'false').lower() in ('1', 'true'):
+        job_id = jobs.enqueue('delete_course', {'course_id': course_id, 'user_id': user.id, 'ip_address': request.remote_addr})
+        return job_accepted(job_id)
+
     db.session.delete(course)
     db.session.commit()
+    course_index.remove(course_id)
 
-    user = User.query.filter_by(username=current_user['username']).first()
     register_audit_log(user.id, "Course Deleted", f"Course '{course.title}' deleted", request.remote_addr)
 
     return jsonify({"msg": "Course deleted successfully"}), 200
 
+# Trabajos en segundo plano
+def job_accepted(job_id):
+    response = jsonify({"msg": "Job queued", "job_id": job_id, "status_url": f'/jobs/{job_id}'})
+    response.status_code = 202
+    response.headers['Location'] = f'/jobs/{job_id}'
+    return response
+
+# Se valida al encolar, para responder 400 en vez de fallar en el worker
+def validate_delete_course_payload(payload):
+    if not isinstance(payload.get('course_id'), int):
+        raise ValueError("'course_id' must be an integer")
+    return payload
+
+@jobs.handler('delete_course', max_concurrency=1, validate=validate_delete_course_payload)
+def delete_course_job(payload, progress):
+    course = Course.query.get(payload['course_id'])
+    if not course:
+        return {"deleted": False}
+    db.session.delete(course)
+    db.session.commit()
+    register_audit_log(payload['user_id'], "Course Deleted", f"Course '{course.title}' deleted", payload['ip_address'])
+    return {"deleted": True}
+
+@jobs.handler('rebuild_indexes', max_concurrency=1)
+def rebuild_indexes_job(payload, progress):
+    db.session.execute(db.text('REINDEX'))
+    progress(0.5, 'Reindexed, analyzing')
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+    return {}
+
+@jobs.handler('purge_expired_tokens', max_concurrency=1)
+def purge_expired_tokens_job(payload, progress):
+    purge_expired_tokens()
+    db.session.commit()
+    return {}
+
+# Encolar un trabajo (solo para admin)
+@app.route('/jobs', methods=['POST'])
+@jwt_required()
+def enqueue_job():
+    current_user = get_jwt_identity()
+
+    if current_user['role'] != 'admin':
+        return jsonify({"msg": "Admins only!"}), 403
+
+    job_type = request.json.get('type')
+    if job_type not in jobs.handlers:
+        return jsonify({"msg": f"Job type must be one of {', '.join(sorted(jobs.handlers))}"}), 400
+
+    payload = request.json.get('payload') or {}
+    if not isinstance(payload, dict):
+        return jsonify({"msg": "'payload' must be an object"}), 400
+
+    user = User.query.filter_by(username=current_user['username']).first()
+    payload = dict(payload, user_id=user.id, ip_address=request.remote_addr)
+    try:
+        job_id = jobs.enqueue(job_type, payload)
+    except ValueError as e:
+        return jsonify({"msg": f"Invalid {job_type} payload: {e}"}), 400
+    register_audit_log(user.id, "Job Queued", f"Queued {job_type} job {job_id}", request.remote_addr)
+
+    return job_accepted(job_id)
+
+# Estado y progreso de un trabajo (solo para admin)
+@app.route('/jobs/<int:job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    current_user = get_jwt_identity()
+
+    if current_user['role'] != 'admin':
+        return jsonify({"msg": "Admins only!"}), 403
+
+    job = jobs.get(job_id)
+    if not job:
+        return jsonify({"msg": "Job not found"}), 404
+
+    return jsonify(job), 200
+
+# Consultas lentas agregadas con su plan de ejecución (solo para admin)
+@app.route('/admin/slow-queries', methods=['GET'])
+@jwt_required()
+def get_slow_queries():
+    current_user = get_jwt_identity()
+
+    if current_user['role'] != 'admin':
+        return jsonify({"msg": "Admins only!"}), 403
+
+    return jsonify(slow_queries.snapshot(request.args.get('limit', 50, type=int))), 200
+
+# Contadores del control de admisión (solo para admin)
+@app.route('/admin/admission', methods=['GET'])
+@jwt_required()
+def get_admission_stats():
+    current_user = get_jwt_identity()
+
+    if current_user['role'] != 'admin':
+        return jsonify({"msg": "Admins only!"}), 403
+
+    return jsonify(admission.stats()), 200
+
 # Iniciar la aplicación y crear las tablas si no existen
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()  # Crear todas las tablas
+        get_course_index()  # Construir el índice de autocompletado al arrancar
     app.run(debug=True)
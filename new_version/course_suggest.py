@@ -0,0 +1,107 @@
+import threading
+import unicodedata
+from bisect import bisect_left, insort
+
+# Índice de prefijos en memoria para autocompletar títulos e instructores.
+# Cada valor se indexa completo y a partir de cada palabra ("Advanced Python"
+# responde a "adv" y a "pyt"), en dos listas ordenadas que se consultan con
+# bisect: una con los valores completos y otra con las palabras siguientes.
+
+def normalize(text):
+    # Sin mayúsculas ni acentos, para que "jose" encuentre "José"
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def _entries(field, value):
+    # Una entrada por palabra; la primera (índice 0) es el valor completo
+    words = normalize(value).split()
+    return [(' '.join(words[i:]), field, value, i) for i in range(len(words))]
+
+class PrefixIndex:
+    FIELDS = ('title', 'instructor')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []   # Valores completos: (clave normalizada, campo, valor, 0) ordenadas
+        self.words = []     # Igual, a partir de la segunda palabra (posición > 0)
+        self.courses = {}   # id del curso -> {campo: valor}
+        self.counts = {}    # (campo, valor) -> número de cursos con ese valor
+
+    def build(self, courses):
+        entries, words, counts, by_id = [], [], {}, {}
+        for course in courses:
+            values = {field: getattr(course, field) for field in self.FIELDS}
+            by_id[course.id] = values
+            for field, value in values.items():
+                counts[(field, value)] = counts.get((field, value), 0) + 1
+                if counts[(field, value)] == 1:
+                    for entry in _entries(field, value):
+                        (words if entry[3] else entries).append(entry)
+        entries.sort()
+        words.sort()
+        with self.lock:
+            self.entries, self.words, self.counts, self.courses = entries, words, counts, by_id
+
+    def _add_value(self, field, value):
+        self.counts[(field, value)] = self.counts.get((field, value), 0) + 1
+        if self.counts[(field, value)] == 1:
+            for entry in _entries(field, value):
+                insort(self.words if entry[3] else self.entries, entry)
+
+    def _remove_value(self, field, value):
+        self.counts[(field, value)] -= 1
+        if self.counts[(field, value)] == 0:
+            del self.counts[(field, value)]
+            for entry in _entries(field, value):
+                entries = self.words if entry[3] else self.entries
+                i = bisect_left(entries, entry)
+                if i < len(entries) and entries[i] == entry:
+                    del entries[i]
+
+    def add(self, course):
+        with self.lock:
+            self._remove_course(course.id)
+            values = {field: getattr(course, field) for field in self.FIELDS}
+            self.courses[course.id] = values
+            for field, value in values.items():
+                self._add_value(field, value)
+
+    def _remove_course(self, course_id):
+        values = self.courses.pop(course_id, None)
+        if values:
+            for field, value in values.items():
+                self._remove_value(field, value)
+
+    def remove(self, course_id):
+        with self.lock:
+            self._remove_course(course_id)
+
+    def _scan(self, entries, prefix, field, max_scan, matches):
+        i = bisect_left(entries, (prefix,))
+        end = min(len(entries), i + max_scan)
+        while i < end and entries[i][0].startswith(prefix):
+            key, entry_field, value, word = entries[i]
+            if (field is None or entry_field == field) and (entry_field, value) not in matches:
+                matches[(entry_field, value)] = (word != 0, -self.counts[(entry_field, value)], len(value), value)
+            i += 1
+
+    def suggest(self, prefix, limit=10, field=None, max_scan=5000):
+        """Devuelve hasta limit valores que empiezan por prefix (o alguna de sus palabras).
+
+        Primero los que coinciden desde el inicio del valor, luego los valores
+        con más cursos y los más cortos. Los valores completos se buscan aparte
+        y las palabras solo si faltan resultados, así que muchas coincidencias
+        por palabra nunca ocultan un valor completo. Cada lista se recorre como
+        mucho max_scan entradas: con más coincidencias que eso, el orden por
+        número de cursos solo considera las primeras en orden alfabético.
+        """
+        prefix = normalize(prefix.strip())
+        if not prefix:
+            return []
+        matches = {}
+        with self.lock:
+            self._scan(self.entries, prefix, field, max_scan, matches)
+            if len(matches) < limit:
+                self._scan(self.words, prefix, field, max_scan, matches)
+            ranked = sorted(matches.items(), key=lambda item: item[1])[:limit]
+            return [{"field": f, "value": v, "courses": self.counts[(f, v)]} for (f, v), _ in ranked]
@@ -175,6 +175,40 @@ document.addEventListener("DOMContentLoaded", function() {
         .catch(error => console.error('Error:', error));
     });
 
+    // Autocompletar títulos e instructores mientras se escribe
+    const suggestInput = document.getElementById('suggest-input');
+    let suggestTimer = null;
+
+    suggestInput.addEventListener('input', function() {
+        clearTimeout(suggestTimer);
+        const query = suggestInput.value.trim();
+        const suggestList = document.getElementById('suggest-list');
+        if (!query) {
+            suggestList.innerHTML = '';
+            return;
+        }
+        // Esperar a que el usuario deje de escribir para no enviar una petición por tecla
+        suggestTimer = setTimeout(function() {
+            fetch(`/courses/suggest?q=${encodeURIComponent(query)}&limit=8`, {
+                method: 'GET',
+                headers: {
+                    'Authorization': `Bearer ${authToken}`
+                }
+            })
+            .then(response => response.json())
+            .then(suggestions => {
+                suggestList.innerHTML = '';
+                suggestions.forEach(suggestion => {
+                    const item = document.createElement('li');
+                    const label = suggestion.field === 'instructor' ? 'Instructor' : 'Curso';
+                    item.textContent = `${suggestion.value} (${label})`;
+                    suggestList.appendChild(item);
+                });
+            })
+            .catch(error => console.error('Error:', error));
+        }, 150);
+    });
+
     // Obtener la lista de cursos
     function fetchCourses() {
         fetch('/courses', {
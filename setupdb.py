@@ -56,7 +56,7 @@ def create_database():
             db.session.add(instructor_role)
 
         # Crear permisos si no existen
-        permissions = ['view_courses', 'view_course', 'create_course', 'update_course', 'delete_course']
+        permissions = ['view_courses', 'view_course', 'create_course', 'update_course', 'delete_course', 'export_data', 'import_courses', 'view_slow_queries', 'view_metrics', 'manage_jobs']
         for perm_name in permissions:
             perm = Permission.query.filter_by(name=perm_name).first()
             if not perm:
@@ -82,9 +82,9 @@ def create_database():
         course2 = Course(title='Machine Learning Basics', description='Learn the fundamentals of machine learning', instructor='Prof. Johnson', duration=50, enrollment_limit=50)
         course3 = Course(title='Python Programming', description='Introductory Python course for beginners', instructor='Ms. Williams', duration=30, enrollment_limit=200)
 
-        db.session.add(course1)
-        db.session.add(course2)
-        db.session.add(course3)
+        for course in [course1, course2, course3]:
+            if not Course.query.filter_by(title=course.title, instructor=course.instructor).first():
+                db.session.add(course)
 
         db.session.commit()
 
@@ -0,0 +1,154 @@
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event
+
+# Slow-query recorder.
+# Statements slower than SLOW_QUERY_THRESHOLD_MS are sampled into a ring buffer
+# and aggregated by normalized SQL, together with the shape of their bind
+# parameters and (for SELECTs on SQLite) their EXPLAIN QUERY PLAN, captured once
+# per normalized statement. At most SLOW_QUERY_MAX_STATEMENTS statements are
+# kept; a new one evicts the statement with the lowest total time. Once a slow
+# statement has been recorded, a background thread logs a summary of the worst
+# statements every SLOW_QUERY_SUMMARY_INTERVAL seconds.
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\((?:\s*(?:\?|:\w+|__\[POSTCOMPILE_\w+\])\s*,?)+\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+def normalize_sql(statement):
+    """Collapse literals, IN lists and whitespace so equivalent statements group together."""
+    sql = _STRING_LITERAL.sub('?', statement)
+    sql = _NUMBER_LITERAL.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+def bind_shape(parameters):
+    if isinstance(parameters, dict):
+        return ', '.join(f'{k}:{type(v).__name__}' for k, v in parameters.items())
+    if isinstance(parameters, (list, tuple)):
+        return ', '.join(type(v).__name__ for v in parameters)
+    return type(parameters).__name__
+
+def is_full_scan(plan):
+    # SQLite reports "SCAN <table>" for a full table scan and "SEARCH ... USING INDEX" for a lookup
+    return any(step.startswith('SCAN ') and ' USING ' not in step for step in plan or ())
+
+class SlowQueryLog:
+    def __init__(self, app=None, db=None):
+        self.lock = threading.Lock()
+        self.recent = deque()
+        self.queries = {}
+        self.summarizer = None
+        if app is not None:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('SLOW_QUERY_THRESHOLD_MS', 50)
+        app.config.setdefault('SLOW_QUERY_SAMPLE_RATE', 1.0)
+        app.config.setdefault('SLOW_QUERY_BUFFER_SIZE', 200)
+        app.config.setdefault('SLOW_QUERY_MAX_STATEMENTS', 500)
+        app.config.setdefault('SLOW_QUERY_SUMMARY_INTERVAL', 300)
+        self.app = app
+        self.recent = deque(maxlen=app.config['SLOW_QUERY_BUFFER_SIZE'])
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(engine, 'handle_error', self._handle_error)
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append((context, time.perf_counter()))
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        _, start = conn.info['query_start_time'].pop()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        config = self.app.config
+        if elapsed_ms >= config['SLOW_QUERY_THRESHOLD_MS'] and random.random() < config['SLOW_QUERY_SAMPLE_RATE']:
+            self.record(conn, statement, parameters, executemany, elapsed_ms)
+
+    def _handle_error(self, context):
+        # A failed statement never reaches after_cursor_execute, so drop its start time here
+        start_times = context.connection.info.get('query_start_time') if context.connection is not None else None
+        if start_times and start_times[-1][0] is context.execution_context:
+            start_times.pop()
+
+    def _explain(self, conn, statement, parameters):
+        if conn.dialect.name != 'sqlite' or not statement.lstrip().upper().startswith('SELECT'):
+            return None
+        # A separate DBAPI cursor, so the statement's own result set is untouched
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            return [row[-1] for row in cursor.fetchall()]
+        except Exception as e:
+            return [f'EXPLAIN failed: {e}']
+        finally:
+            cursor.close()
+
+    def record(self, conn, statement, parameters, executemany, elapsed_ms):
+        sql = normalize_sql(statement)
+        shape = bind_shape(parameters[0] if executemany and parameters else parameters)
+        with self.lock:
+            entry = self.queries.get(sql)
+            needs_plan = entry is None
+        plan = self._explain(conn, statement, parameters) if needs_plan and not executemany else None
+
+        with self.lock:
+            if sql not in self.queries and len(self.queries) >= self.app.config['SLOW_QUERY_MAX_STATEMENTS']:
+                del self.queries[min(self.queries, key=lambda q: self.queries[q]['total_ms'])]
+            entry = self.queries.setdefault(sql, {
+                'sql': sql, 'count': 0, 'total_ms': 0.0, 'max_ms': 0.0,
+                'bind_shapes': [], 'plan': plan, 'full_scan': is_full_scan(plan),
+            })
+            entry['count'] += 1
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+            if shape not in entry['bind_shapes'] and len(entry['bind_shapes']) < 10:
+                entry['bind_shapes'].append(shape)
+            self.recent.append({
+                'timestamp': datetime.utcnow().isoformat(),
+                'sql': sql,
+                'duration_ms': round(elapsed_ms, 3),
+                'bind_shape': shape,
+            })
+            if self.summarizer is None or not self.summarizer.is_alive():
+                self.summarizer = threading.Thread(target=self._log_summary_periodically, daemon=True)
+                self.summarizer.start()
+
+    def _log_summary_periodically(self):
+        while True:
+            time.sleep(self.app.config['SLOW_QUERY_SUMMARY_INTERVAL'])
+            try:
+                self.log_summary()
+            except Exception:
+                self.app.logger.exception('Could not log the slow query summary')
+
+    def snapshot(self, limit=50):
+        with self.lock:
+            queries = sorted(self.queries.values(), key=lambda q: q['total_ms'], reverse=True)[:limit]
+            return {
+                'threshold_ms': self.app.config['SLOW_QUERY_THRESHOLD_MS'],
+                'sample_rate': self.app.config['SLOW_QUERY_SAMPLE_RATE'],
+                'queries': [{**q, 'bind_shapes': list(q['bind_shapes']),
+                             'avg_ms': q['total_ms'] / q['count']} for q in queries],
+                'recent': list(self.recent),
+            }
+
+    def log_summary(self, limit=5):
+        top = self.snapshot(limit)['queries']
+        if not top:
+            return
+        lines = [f'{q["count"]}x total {q["total_ms"]:.1f}ms max {q["max_ms"]:.1f}ms'
+                 f'{" FULL SCAN" if q["full_scan"] else ""}: {q["sql"]}' for q in top]
+        self.app.logger.warning('Slowest queries:\n%s', '\n'.join(lines))
+
+    def reset(self):
+        with self.lock:
+            self.recent.clear()
+            self.queries.clear()
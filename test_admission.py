@@ -0,0 +1,69 @@
+import threading
+import time
+
+from flask import Flask
+
+from admission import AdmissionControl
+
+def make_control(max_concurrency=2, queue=4, timeout=0.2):
+    app = Flask(__name__)
+    app.config['ADMISSION_MAX_CONCURRENCY'] = max_concurrency
+    app.config['ADMISSION_CLASSES'] = {
+        'high': {'share': 1.0, 'queue': queue, 'timeout': timeout},
+        'normal': {'share': 0.75, 'queue': queue, 'timeout': timeout},
+        'low': {'share': 0.5, 'queue': queue, 'timeout': timeout},
+    }
+    return AdmissionControl(app)
+
+def acquire_in_thread(control, endpoint, priority, results):
+    thread = threading.Thread(target=lambda: results.append((priority, control.acquire(endpoint, priority))))
+    thread.start()
+    return thread
+
+def wait_for_waiters(control, priority, count):
+    deadline = time.monotonic() + 2
+    while control.waiting[priority] < count and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert control.waiting[priority] == count
+
+def test_lower_classes_only_use_their_share():
+    control = make_control(max_concurrency=2)
+    assert control.acquire('a', 'low') is None
+    # low may hold half of the 2 slots, high may still take the other one
+    assert control.acquire('a', 'low') == 'timeout'
+    assert control.acquire('a', 'high') is None
+    assert control.stats()['in_flight'] == 2
+
+def test_full_queue_is_shed_without_waiting():
+    control = make_control(max_concurrency=1, queue=0, timeout=5)
+    assert control.acquire('a', 'high') is None
+    started = time.monotonic()
+    assert control.acquire('a', 'high') == 'queue_full'
+    assert time.monotonic() - started < 1
+    assert control.stats()['classes']['high']['shed_queue_full'] == 1
+
+def test_freed_slot_goes_to_higher_class_first():
+    control = make_control(max_concurrency=1, timeout=0.5)
+    assert control.acquire('a', 'high') is None
+    results = []
+    low = acquire_in_thread(control, 'a', 'low', results)
+    wait_for_waiters(control, 'low', 1)
+    high = acquire_in_thread(control, 'a', 'high', results)
+    wait_for_waiters(control, 'high', 1)
+
+    control.release('a')
+    high.join()
+    low.join()
+    # high got the slot; low timed out behind it even though it queued first
+    assert results == [('high', None), ('low', 'timeout')]
+    assert control.stats()['classes']['low']['shed_timeout'] == 1
+
+def test_route_limit_and_release():
+    control = make_control(max_concurrency=4, timeout=0.1)
+    control.app.config['ADMISSION_ROUTE_LIMITS'] = {'login': 1}
+    assert control.acquire('login', 'high') is None
+    assert control.acquire('login', 'high') == 'timeout'
+    assert control.acquire('other', 'high') is None
+    control.release('login')
+    assert control.acquire('login', 'high') is None
+    assert control.stats()['route_in_flight'] == {'login': 1, 'other': 1}
@@ -0,0 +1,67 @@
+def login(client, username, role='admin'):
+    client.post('/register', json={'username': username, 'password': 'pw', 'role': role})
+    tokens = client.post('/login', json={'username': username, 'password': 'pw'}).json
+    return {'Authorization': 'Bearer ' + tokens['access_token']}, {'Authorization': 'Bearer ' + tokens['refresh_token']}
+
+def test_refresh_issues_access_token_with_current_role(lms2):
+    client = lms2.app.test_client()
+    access, refresh = login(client, 'ana', role='admin')
+    with lms2.app.app_context():
+        lms2.User.query.filter_by(username='ana').one().role = 'viewer'
+        lms2.db.session.commit()
+
+    response = client.post('/refresh', headers=refresh)
+    assert response.status_code == 200
+    assert response.json['role'] == 'viewer'
+    new_access = {'Authorization': 'Bearer ' + response.json['access_token']}
+    assert client.get('/admin/admission', headers=new_access).status_code == 403
+    # Access tokens cannot be used to refresh
+    assert client.post('/refresh', headers=access).status_code == 422
+
+def test_refresh_fails_for_deleted_user(lms2):
+    client = lms2.app.test_client()
+    _, refresh = login(client, 'ana')
+    with lms2.app.app_context():
+        lms2.User.query.filter_by(username='ana').delete()
+        lms2.db.session.commit()
+    assert client.post('/refresh', headers=refresh).status_code == 401
+
+def test_logout_with_access_token_revokes_whole_session(lms2):
+    client = lms2.app.test_client()
+    access, refresh = login(client, 'ana')
+    refreshed = {'Authorization': 'Bearer ' + client.post('/refresh', headers=refresh).json['access_token']}
+
+    assert client.delete('/logout', headers=refreshed).status_code == 200
+    # The refresh token and every access token of the session are rejected
+    assert client.post('/refresh', headers=refresh).status_code == 401
+    assert client.get('/protected', headers=access).status_code == 401
+    assert client.get('/protected', headers=refreshed).status_code == 401
+
+def test_logout_with_refresh_token(lms2):
+    client = lms2.app.test_client()
+    access, refresh = login(client, 'ana')
+    assert client.delete('/logout', headers=refresh).status_code == 200
+    assert client.post('/refresh', headers=refresh).status_code == 401
+    assert client.get('/protected', headers=access).status_code == 401
+
+def test_logout_leaves_other_sessions_alone(lms2):
+    client = lms2.app.test_client()
+    access, _ = login(client, 'ana')
+    other = client.post('/login', json={'username': 'ana', 'password': 'pw'}).json
+    other_access = {'Authorization': 'Bearer ' + other['access_token']}
+
+    client.delete('/logout', headers=access)
+    assert client.get('/protected', headers=other_access).status_code == 200
+    assert client.post('/refresh', headers={'Authorization': 'Bearer ' + other['refresh_token']}).status_code == 200
+
+def test_purge_removes_only_expired_entries(lms2):
+    from datetime import datetime, timedelta
+    with lms2.app.app_context():
+        lms2.db.session.add_all([
+            lms2.TokenBlocklist(jti='expired', token_type='access', expires=datetime.utcnow() - timedelta(minutes=1)),
+            lms2.TokenBlocklist(jti='live', token_type='refresh', expires=datetime.utcnow() + timedelta(days=1)),
+        ])
+        lms2.db.session.commit()
+        lms2.purge_expired_tokens()
+        lms2.db.session.commit()
+        assert [t.jti for t in lms2.TokenBlocklist.query] == ['live']
@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+def logged_events(lms, action):
+    # Full rows plus rolled-up counters, straight from the tables
+    with lms.app.app_context():
+        lms.audit_policy.flush()
+        full = lms.AuditLog.query.filter_by(action=action).count()
+        rollup = lms.audit_policy.model
+        counted = lms.db.session.query(lms.db.func.sum(rollup.count)).filter(rollup.action == action).scalar() or 0
+        return full, counted
+
+def view_courses(lms, auth, times):
+    client = lms.app.test_client()
+    for _ in range(times):
+        assert client.get('/courses', headers=auth()).status_code == 200
+
+@pytest.mark.parametrize('policy', [{'mode': 'full'}, {'mode': 'sample', 'rate': 0.3}, {'mode': 'rollup'}])
+def test_every_event_is_counted_once(lms, auth, monkeypatch, policy):
+    monkeypatch.setitem(lms.app.config, 'AUDIT_POLICIES', {'view_courses': policy})
+    random.seed(1)
+    view_courses(lms, auth, 40)
+    full, counted = logged_events(lms, 'view_courses')
+    assert full + counted == 40
+    if policy['mode'] == 'full':
+        assert full == 40
+    elif policy['mode'] == 'rollup':
+        assert full == 0
+    else:
+        assert 0 < full < 40
+    with lms.app.app_context():
+        assert lms.audit_policy.totals()['view_courses'] == 40
+
+def test_totals_survive_policy_changes(lms, auth, monkeypatch):
+    for policy in [{'mode': 'full'}, {'mode': 'rollup'}, {'mode': 'sample', 'rate': 0.5}, {'mode': 'rollup'}]:
+        monkeypatch.setitem(lms.app.config, 'AUDIT_POLICIES', {'view_courses': policy})
+        view_courses(lms, auth, 10)
+    assert sum(logged_events(lms, 'view_courses')) == 40
+    with lms.app.app_context():
+        totals = lms.audit_policy.totals()
+    assert totals['view_courses'] == 40
+
+def test_pending_counts_are_kept_when_a_flush_fails(lms, auth, monkeypatch):
+    monkeypatch.setitem(lms.app.config, 'AUDIT_POLICIES', {'view_courses': {'mode': 'rollup'}})
+    view_courses(lms, auth, 5)
+    with lms.app.app_context():
+        lms.db.session.execute(lms.db.text('DROP TABLE audit_rollup'))
+        lms.db.session.commit()
+        with pytest.raises(Exception):
+            lms.audit_policy.flush()
+        assert sum(lms.audit_policy.pending.values()) == 5
+        lms.audit_policy.table.create(lms.db.engine)
+    view_courses(lms, auth, 2)
+    assert logged_events(lms, 'view_courses') == (0, 7)
+
+def test_audit_totals_command(lms, auth, monkeypatch):
+    monkeypatch.setitem(lms.app.config, 'AUDIT_POLICIES', {'view_courses': {'mode': 'rollup'}})
+    view_courses(lms, auth, 3)
+    result = lms.app.test_cli_runner().invoke(args=['audit-totals'])
+    assert result.exit_code == 0, result.output
+    assert '         3  view_courses' in result.output.splitlines()
@@ -0,0 +1,67 @@
+def add_courses(lms, count):
+    with lms.app.app_context():
+        lms.db.session.add_all([lms.Course(title=f'Course {i}', instructor='Ana', duration=10) for i in range(count)])
+        lms.db.session.commit()
+
+MIXED = {'requests': [
+    {'path': '/courses/1'},
+    {'method': 'get', 'path': '/courses/2'},
+    {'path': '/courses/99'},
+    {'path': '/courses'},
+    {'method': 'DELETE', 'path': '/courses/1'},
+    {'method': 'POST', 'path': '/courses/1'},
+    {'path': '/nope'},
+    {'path': '/courses/stats'},
+    {'method': 5, 'path': '/courses/1'},
+    {'method': 'GET'},
+    'not an object',
+]}
+
+def test_batch_answers_each_sub_request(lms, auth):
+    add_courses(lms, 2)
+    response = lms.app.test_client().post('/batch', json=MIXED, headers=auth())
+    assert response.status_code == 200
+    responses = response.json['responses']
+    assert [r['status'] for r in responses] == [200, 200, 404, 200, 400, 405, 404, 400, 400, 400, 400]
+    assert responses[0]['body']['title'] == 'Course 0'
+    assert len(responses[3]['body']) == 2
+    # Only reads can be batched: the course is still there
+    with lms.app.app_context():
+        assert lms.db.session.get(lms.Course, 1) is not None
+
+def test_batch_checks_each_sub_request_permission(lms, auth):
+    add_courses(lms, 1)
+    with lms.app.app_context():
+        instructor = lms.Role.query.filter_by(name='instructor').one()
+        instructor.permissions = [p for p in instructor.permissions if p.name != 'view_course']
+        lms.db.session.commit()
+    response = lms.app.test_client().post('/batch', json={'requests': [{'path': '/courses/1'}, {'path': '/courses'}]},
+                                          headers=auth('instructor'))
+    assert [r['status'] for r in response.json['responses']] == [403, 200]
+
+def test_batch_size_limits(lms, auth):
+    client = lms.app.test_client()
+    assert client.post('/batch', json={'requests': []}, headers=auth()).status_code == 400
+    assert client.post('/batch', json={'requests': [{'path': '/courses'}] * 51}, headers=auth()).status_code == 400
+
+def test_every_sub_request_counts_against_the_rate_limit(lms, auth):
+    add_courses(lms, 1)
+    lms.limiter.enabled = True
+    client = lms.app.test_client()
+    batch = lambda size: {'requests': [{'path': '/courses/1'}] * size}
+    # 60 sub-requests per minute, however they are split into batches
+    assert client.post('/batch', json=batch(50), headers=auth()).status_code == 200
+    assert client.post('/batch', json=batch(10), headers=auth()).status_code == 200
+    assert client.post('/batch', json=batch(1), headers=auth()).status_code == 429
+
+def test_app2_batch(lms2):
+    client = lms2.app.test_client()
+    client.post('/register', json={'username': 'ana', 'password': 'pw', 'role': 'viewer'})
+    token = client.post('/login', json={'username': 'ana', 'password': 'pw'}).json['access_token']
+    with lms2.app.app_context():
+        lms2.db.session.add_all([lms2.Course(title=f'Course {i}', instructor='Ana', duration=10) for i in range(2)])
+        lms2.db.session.commit()
+    response = client.post('/batch', json=MIXED, headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 200
+    # new_version has no /courses/stats, so that path is unknown there
+    assert [r['status'] for r in response.json['responses']] == [200, 200, 404, 200, 400, 405, 404, 404, 400, 400, 400]
@@ -0,0 +1,131 @@
+import io
+
+import click
+import pytest
+import sqlalchemy as sa
+
+import course_import
+
+def run_import(lms, text, fmt, chunk_size=2):
+    rejects = []
+    with lms.app.app_context():
+        result = course_import.import_courses(
+            lms.db.session, lms.Course, lms.course_schema, course_import.iter_rows(io.StringIO(text), fmt),
+            chunk_size=chunk_size, on_reject=lambda line, row, errors: rejects.append((line, errors)))
+    return result, rejects
+
+def courses(lms):
+    with lms.app.app_context():
+        return {(c.title, c.instructor): c for c in lms.Course.query}
+
+def natural_key_exists(lms):
+    with lms.app.app_context():
+        indexes = sa.inspect(lms.db.engine).get_indexes('course')
+        return any(i['name'] == 'ix_course_title_instructor' and i['unique'] for i in indexes)
+
+def add_duplicates(lms):
+    # A catalog from before the natural key: drop it so duplicates can go in
+    with lms.app.app_context():
+        lms.course_natural_key.drop(lms.db.engine)
+        lms.db.session.add_all([lms.Course(title='Python', instructor='Ana', duration=10),
+                                lms.Course(title='Python', instructor='Ana', duration=20),
+                                lms.Course(title='Rust', instructor='Luis', duration=15),
+                                lms.Course(title='Python', instructor='Ana', duration=30),
+                                lms.Course(title='Rust', instructor='Luis', duration=40),
+                                lms.Course(title='Go', instructor='Ana', duration=5)])
+        lms.db.session.commit()
+
+def test_csv_rows_are_inserted_and_rejected(lms):
+    text = ('title,instructor,duration,enrollment_limit\n'
+            'Python,Ana,10,\n'
+            'Rust,Ana,20,30\n'
+            ',Ana,5,\n'
+            'Go,Luis,0,\n'
+            'SQL,Luis,15,\n')
+    result, rejects = run_import(lms, text, 'csv')
+    assert (result['inserted'], result['updated'], result['rejected']) == (3, 0, 2)
+    assert [line for line, _ in rejects] == [4, 5]
+    assert 'title' in rejects[0][1] and 'duration' in rejects[1][1]
+    imported = courses(lms)
+    assert imported[('Python', 'Ana')].enrollment_limit is None
+    assert imported[('Rust', 'Ana')].enrollment_limit == 30
+
+def test_rows_are_upserted_on_title_and_instructor(lms):
+    run_import(lms, 'title,instructor,duration\nPython,Ana,10\nPython,Luis,12\n', 'csv')
+    result, _ = run_import(lms, ('{"title": "Python", "instructor": "Ana", "duration": 40}\n'
+                                 '{"title": "Python", "instructor": "Ana", "duration": 50}\n'
+                                 '{"title": "Go", "instructor": "Ana", "duration": 5}\n'), 'jsonl', chunk_size=10)
+    assert (result['inserted'], result['updated'], result['rejected']) == (1, 2, 0)
+    durations = {key: c.duration for key, c in courses(lms).items()}
+    assert durations == {('Python', 'Ana'): 50, ('Python', 'Luis'): 12, ('Go', 'Ana'): 5}
+    with lms.app.app_context():
+        assert lms.stored_course_stats() == lms.scan_course_stats()
+
+def test_invalid_jsonl_lines_are_rejected(lms):
+    text = '{"title": "Python", "instructor": "Ana", "duration": 10}\nnot json\n\n[1, 2]\n'
+    result, rejects = run_import(lms, text, 'jsonl')
+    assert (result['inserted'], result['rejected']) == (1, 2)
+    assert [line for line, _ in rejects] == [2, 4]
+    assert all('_row' in errors for _, errors in rejects)
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        list(course_import.iter_rows(io.StringIO(''), 'xml'))
+
+def test_import_endpoint(lms, auth):
+    upload = (io.BytesIO(b'title,instructor,duration\nPython,Ana,10\nGo,Ana,abc\n'), 'courses.csv')
+    response = lms.app.test_client().post('/courses/import', data={'file': upload}, headers=auth())
+    assert response.status_code == 200
+    assert (response.json['inserted'], response.json['rejected']) == (1, 1)
+    assert response.json['rejects'][0]['line'] == 3
+
+def test_import_command(lms, tmp_path):
+    source = tmp_path / 'courses.jsonl'
+    source.write_text('{"title": "Python", "instructor": "Ana", "duration": 10}\n{"title": ""}\n')
+    rejects = tmp_path / 'rejects.jsonl'
+    result = lms.app.test_cli_runner().invoke(args=['import-courses', str(source), '--rejects', str(rejects)])
+    assert result.exit_code == 0, result.output
+    assert '1 inserted, 0 updated, 1 rejected' in result.output
+    assert len(rejects.read_text().splitlines()) == 1
+
+def test_natural_key_is_not_created_over_duplicates(lms):
+    add_duplicates(lms)
+    with lms.app.app_context():
+        assert lms.find_duplicate_courses() == [('Python', 'Ana', [1, 2, 4]), ('Rust', 'Luis', [3, 5])]
+        with pytest.raises(click.ClickException, match='2 title/instructor pairs'):
+            lms.create_course_natural_key()
+    assert not natural_key_exists(lms)
+
+def test_import_command_refuses_duplicate_catalogs(lms, tmp_path):
+    add_duplicates(lms)
+    source = tmp_path / 'courses.csv'
+    source.write_text('title,instructor,duration\nPython,Ana,99\n')
+    result = lms.app.test_cli_runner().invoke(args=['import-courses', str(source)])
+    assert result.exit_code == 1
+    assert 'dedupe-courses' in result.output
+    assert [c.duration for c in courses(lms).values()] == [30, 40, 5]
+
+def test_dedupe_lists_without_merge(lms):
+    add_duplicates(lms)
+    result = lms.app.test_cli_runner().invoke(args=['dedupe-courses'])
+    assert result.exit_code == 1
+    assert "'Python' by 'Ana': courses 1, 2, 4" in result.output
+    assert "'Rust' by 'Luis': courses 3, 5" in result.output
+    with lms.app.app_context():
+        assert lms.Course.query.count() == 6
+    assert not natural_key_exists(lms)
+
+def test_dedupe_merge_keeps_the_oldest_course(lms):
+    add_duplicates(lms)
+    result = lms.app.test_cli_runner().invoke(args=['dedupe-courses', '--merge'])
+    assert result.exit_code == 0, result.output
+    assert 'Deleted 3 duplicate courses' in result.output
+    with lms.app.app_context():
+        assert sorted((c.id, c.duration) for c in lms.Course.query) == [(1, 10), (3, 15), (6, 5)]
+        assert lms.stored_course_stats() == lms.scan_course_stats()
+        assert lms.find_duplicate_courses() == []
+    assert natural_key_exists(lms)
+    # Nothing left to merge, and the key now holds
+    assert lms.app.test_cli_runner().invoke(args=['dedupe-courses']).output.startswith('No duplicate courses')
+    run_import(lms, 'title,instructor,duration\nPython,Ana,12\n', 'csv')
+    assert courses(lms)[('Python', 'Ana')].id == 1
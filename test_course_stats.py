@@ -0,0 +1,81 @@
+def assert_consistent(lms):
+    with lms.app.app_context():
+        assert lms.stored_course_stats() == lms.scan_course_stats()
+
+def test_summaries_follow_create_update_and_delete(lms, auth):
+    client = lms.app.test_client()
+    for title, instructor, duration, limit in [('Python', 'Ana', 12, 30), ('Rust', 'Ana', 25, None),
+                                               ('Go', 'Luis', 18, 10)]:
+        course = {'title': title, 'instructor': instructor, 'duration': duration}
+        if limit:
+            course['enrollment_limit'] = limit
+        assert client.post('/courses', json=course, headers=auth()).status_code == 201
+    assert_consistent(lms)
+    with lms.app.app_context():
+        assert lms.stored_course_stats()[('total', '')] == (3, 55, 40)
+        assert lms.stored_course_stats()[('instructor', 'Ana')] == (2, 37, 30)
+
+    # Move a course to another instructor and another duration bucket
+    response = client.put('/courses/1', json={'title': 'Python', 'instructor': 'Luis', 'duration': 31,
+                                              'enrollment_limit': 5}, headers=auth())
+    assert response.status_code == 200
+    assert_consistent(lms)
+    with lms.app.app_context():
+        stats = lms.stored_course_stats()
+        assert stats[('instructor', 'Luis')] == (2, 49, 15)
+        assert ('duration', '10') in stats and ('duration', '30') in stats
+
+    assert client.delete('/courses/3', headers=auth()).status_code == 204
+    assert client.delete('/courses/2', headers=auth()).status_code == 204
+    assert_consistent(lms)
+    with lms.app.app_context():
+        stats = lms.stored_course_stats()
+        # Emptied instructors and buckets are dropped, the total row stays
+        assert stats == {('total', ''): (1, 31, 5), ('instructor', 'Luis'): (1, 31, 5), ('duration', '30'): (1, 31, 5)}
+
+def test_rejected_write_leaves_summaries_alone(lms, auth):
+    client = lms.app.test_client()
+    client.post('/courses', json={'title': 'Python', 'instructor': 'Ana', 'duration': 12}, headers=auth())
+    # Duplicate natural key: the insert fails and the summary changes roll back with it
+    response = client.post('/courses', json={'title': 'Python', 'instructor': 'Ana', 'duration': 40}, headers=auth())
+    assert response.status_code == 409
+    assert_consistent(lms)
+
+def test_numeric_strings_are_stored_as_integers(lms, auth):
+    client = lms.app.test_client()
+    response = client.post('/courses', json={'title': 'Python', 'instructor': 'Ana', 'duration': '25'}, headers=auth())
+    assert response.status_code == 201
+    assert response.json['duration'] == 25
+    assert_consistent(lms)
+    histogram = client.get('/courses/stats', headers=auth()).json['duration_histogram']
+    assert histogram == [{'bucket_start': 20, 'bucket_end': 30, 'course_count': 1}]
+
+def insert_without_summaries(lms, rows):
+    # A catalog created before the summaries existed: rows written with a core
+    # INSERT do not go through the session listener
+    with lms.app.app_context():
+        lms.db.session.execute(lms.Course.__table__.insert(), rows)
+        lms.db.session.commit()
+        assert lms.stored_course_stats() == {}
+
+def test_first_write_seeds_an_existing_catalog(lms, auth):
+    insert_without_summaries(lms, [{'title': f'Course {i}', 'instructor': 'Ana', 'duration': 10 + i}
+                                   for i in range(4)])
+    client = lms.app.test_client()
+    assert client.delete('/courses/1', headers=auth()).status_code == 204
+    assert_consistent(lms)
+    with lms.app.app_context():
+        assert lms.stored_course_stats()[('total', '')] == (3, 36, 0)
+
+def test_first_read_seeds_an_existing_catalog(lms, auth):
+    insert_without_summaries(lms, [{'title': 'Python', 'instructor': 'Ana', 'duration': 12}])
+    response = lms.app.test_client().get('/courses/stats', headers=auth())
+    assert response.json['course_count'] == 1
+    assert_consistent(lms)
+
+def test_check_and_recompute_commands(lms):
+    insert_without_summaries(lms, [{'title': 'Python', 'instructor': 'Ana', 'duration': 12}])
+    runner = lms.app.test_cli_runner()
+    assert runner.invoke(args=['check-course-stats']).exit_code == 1
+    assert runner.invoke(args=['recompute-course-stats']).exit_code == 0
+    assert runner.invoke(args=['check-course-stats']).exit_code == 0
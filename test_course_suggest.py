@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+from course_suggest import PrefixIndex, normalize
+
+def course(id, title, instructor):
+    return SimpleNamespace(id=id, title=title, instructor=instructor)
+
+def make_index():
+    index = PrefixIndex()
+    index.build([
+        course(1, 'Advanced Python', 'José Pérez'),
+        course(2, 'Python Basics', 'Ana Gómez'),
+        course(3, 'Data Science with Python', 'Ana Gómez'),
+    ])
+    return index
+
+def values(suggestions):
+    return [s['value'] for s in suggestions]
+
+def test_normalize_drops_case_and_accents():
+    assert normalize('José PÉREZ') == 'jose perez'
+
+def test_whole_value_matches_rank_before_word_matches():
+    assert values(make_index().suggest('pyt')) == ['Python Basics', 'Advanced Python', 'Data Science with Python']
+
+def test_accent_insensitive_and_counted_per_value():
+    suggestions = make_index().suggest('gom')
+    assert suggestions == [{'field': 'instructor', 'value': 'Ana Gómez', 'courses': 2}]
+    assert values(make_index().suggest('jose')) == ['José Pérez']
+
+def test_field_filter_limit_and_empty_prefix():
+    index = make_index()
+    assert values(index.suggest('a', field='title')) == ['Advanced Python']
+    assert len(index.suggest('p', limit=1)) == 1
+    assert index.suggest('   ') == []
+
+def test_add_and_remove_keep_counts():
+    index = make_index()
+    index.add(course(4, 'Rust', 'Ana Gómez'))
+    assert index.suggest('ana')[0]['courses'] == 3
+    # Updating a course replaces its old values
+    index.add(course(4, 'Rust for Pythonistas', 'Ana Gómez'))
+    assert values(index.suggest('rust')) == ['Rust for Pythonistas']
+    index.remove(2)
+    index.remove(3)
+    index.remove(4)
+    assert index.suggest('ana') == []
+    assert values(index.suggest('pyt')) == ['Advanced Python']
+
+def test_word_matches_never_hide_a_whole_value_match():
+    index = PrefixIndex()
+    index.build([course(i, f'Intro to Pa{i:03}', 'Ana') for i in range(250)] +
+                [course(1000 + i, 'Python', 'Luis') for i in range(50)])
+    suggestions = index.suggest('p')
+    assert suggestions[0] == {'field': 'title', 'value': 'Python', 'courses': 50}
+    assert values(suggestions[1:]) == [f'Intro to Pa{i:03}' for i in range(9)]
+
+def test_suggest_endpoint_clamps_the_limit(lms2):
+    client = lms2.app.test_client()
+    client.post('/register', json={'username': 'ana', 'password': 'pw', 'role': 'viewer'})
+    token = client.post('/login', json={'username': 'ana', 'password': 'pw'}).json['access_token']
+    with lms2.app.app_context():
+        lms2.db.session.add_all([lms2.Course(title=f'Python {i:02}', instructor='Ana', duration=10) for i in range(30)])
+        lms2.db.session.commit()
+        lms2.refresh_course_index()
+    headers = {'Authorization': f'Bearer {token}'}
+    for limit, expected in [(None, 10), (-5, 1), (0, 1), (3, 3), (100, 20)]:
+        query = {'q': 'pyt'} if limit is None else {'q': 'pyt', 'limit': limit}
+        response = client.get('/courses/suggest', query_string=query, headers=headers)
+        assert response.status_code == 200
+        assert len(response.json) == expected
+    assert client.get('/courses/suggest?q=a&field=description', headers=headers).status_code == 400
@@ -0,0 +1,102 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import export
+
+class Interrupted(Exception):
+    pass
+
+def interrupt_after(batches):
+    def progress(rows, rate):
+        progress.calls += 1
+        if progress.calls == batches:
+            raise Interrupted()
+    progress.calls = 0
+    return progress
+
+def read(path, compress=False):
+    with (gzip.open if compress else open)(path, 'rt') as f:
+        return f.read()
+
+@pytest.fixture
+def audit_entries(lms):
+    start = datetime(2024, 5, 1)
+    with lms.app.app_context():
+        lms.db.session.add_all([lms.AuditLog(user_id=1, action=f'action {i % 3}', details=f'entry {i}',
+                                             timestamp=start + timedelta(hours=i)) for i in range(25)])
+        lms.db.session.commit()
+    return lms
+
+@pytest.mark.parametrize('fmt,compress', [('csv', False), ('jsonl', False), ('csv', True)])
+def test_resume_writes_every_row_once(audit_entries, tmp_path, fmt, compress):
+    lms = audit_entries
+    expected, output, checkpoint = str(tmp_path / 'expected'), str(tmp_path / 'out'), str(tmp_path / 'out.ckpt')
+    with lms.app.app_context():
+        export.export_to_file(lms.db.session, lms.AuditLog, expected, fmt, compress, batch_size=10)
+        with pytest.raises(Interrupted):
+            export.export_to_file(lms.db.session, lms.AuditLog, output, fmt, compress, checkpoint=checkpoint,
+                                  batch_size=10, progress=interrupt_after(2))
+        assert export.read_checkpoint(checkpoint)['last_id'] == 20
+        # Bytes written after the checkpoint (a partly flushed batch) are discarded on resume
+        with open(output, 'ab') as f:
+            f.write(b'partial row')
+
+        rows, _ = export.export_to_file(lms.db.session, lms.AuditLog, output, fmt, compress,
+                                        checkpoint=checkpoint, batch_size=10)
+    assert rows == 5
+    assert read(output, compress) == read(expected, compress)
+    assert export.read_checkpoint(checkpoint)['rows'] == 25
+
+def test_resume_refuses_a_checkpoint_for_other_arguments(audit_entries, tmp_path):
+    lms = audit_entries
+    output, checkpoint = str(tmp_path / 'out.jsonl'), str(tmp_path / 'out.ckpt')
+    with lms.app.app_context():
+        with pytest.raises(Interrupted):
+            export.export_to_file(lms.db.session, lms.AuditLog, output, 'jsonl', checkpoint=checkpoint,
+                                  options=lms.export_options(actions=()), batch_size=10, progress=interrupt_after(1))
+        with pytest.raises(ValueError):
+            export.export_to_file(lms.db.session, lms.AuditLog, output, 'jsonl', checkpoint=checkpoint,
+                                  filters=lms.export_filters(lms.AuditLog, actions=['action 1']),
+                                  options=lms.export_options(actions=['action 1']), batch_size=10)
+        with pytest.raises(ValueError):
+            export.export_to_file(lms.db.session, lms.Course, output, 'jsonl', checkpoint=checkpoint, batch_size=10)
+
+        export.export_to_file(lms.db.session, lms.AuditLog, output, 'jsonl', checkpoint=checkpoint,
+                              options=lms.export_options(actions=()), batch_size=10)
+    with open(output) as f:
+        assert [json.loads(line)['id'] for line in f] == list(range(1, 26))
+
+def test_cli_export_filters_and_removes_checkpoint(audit_entries, tmp_path):
+    output, checkpoint = tmp_path / 'audit.csv', tmp_path / 'audit.ckpt'
+    result = audit_entries.app.test_cli_runner().invoke(args=[
+        'export', 'audit_log', '-o', str(output), '--since', '2024-05-01 05:00:00', '--until', '2024-05-01 10:00:00',
+        '--action', 'action 0', '--checkpoint', str(checkpoint)])
+    assert result.exit_code == 0, result.output
+    lines = output.read_text().splitlines()
+    assert lines[0] == 'id,timestamp,user_id,action,details'
+    assert [line.split(',')[0] for line in lines[1:]] == ['7', '10']
+    assert not checkpoint.exists()
+
+def test_http_export_streams_gzip_and_resumes_after_id(audit_entries, auth):
+    client = audit_entries.app.test_client()
+    response = client.get('/export/audit_log?format=jsonl&gzip=true&after_id=20', headers=auth())
+    assert response.status_code == 200
+    assert response.mimetype == 'application/gzip'
+    rows = [json.loads(line) for line in gzip.decompress(response.data).decode().splitlines()]
+    # The export itself is audited before the rows are streamed
+    assert [row['id'] for row in rows] == [21, 22, 23, 24, 25, 26]
+    assert rows[-1]['action'] == 'export_data'
+
+    response = client.get('/export/courses', headers=auth())
+    assert response.mimetype == 'text/csv'
+    assert response.get_data(as_text=True) == 'id,title,description,instructor,duration,enrollment_limit\n'
+
+def test_http_export_checks_permission_and_filters(audit_entries, auth):
+    client = audit_entries.app.test_client()
+    assert client.get('/export/audit_log', headers=auth('instructor')).status_code == 403
+    assert client.get('/export/nope', headers=auth()).status_code == 404
+    assert client.get('/export/courses?since=2024-01-01', headers=auth()).status_code == 400
+    assert client.get('/export/audit_log?since=yesterday', headers=auth()).status_code == 400
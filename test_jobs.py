@@ -0,0 +1,144 @@
+import gzip
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+@pytest.fixture
+def jobs(lms, monkeypatch):
+    # Handlers registered by a test are dropped afterwards
+    monkeypatch.setattr(lms.jobs, 'handlers', dict(lms.jobs.handlers))
+    with lms.app.app_context():
+        yield lms.jobs
+
+def make_runnable(jobs, job_id):
+    jobs._update(job_id, run_at=datetime.utcnow() - timedelta(seconds=1))
+
+def run_next(jobs):
+    job_id = jobs.claim()
+    assert job_id is not None
+    jobs.run_job(job_id)
+    return jobs.get(job_id)
+
+def test_failed_jobs_are_retried_with_backoff(lms, jobs, monkeypatch):
+    monkeypatch.setitem(lms.app.config, 'JOBS_RETRY_BACKOFF', 10)
+    calls = []
+    @jobs.handler('flaky', max_attempts=3)
+    def flaky(payload, progress):
+        calls.append(payload)
+        raise RuntimeError('try again')
+
+    job_id = jobs.enqueue('flaky', {'n': 1})
+    for attempt, backoff in [(1, 10), (2, 20)]:
+        started = datetime.utcnow()
+        job = run_next(jobs)
+        assert (job['status'], job['attempts']) == ('queued', attempt)
+        assert 'RuntimeError: try again' in job['error']
+        delay = (datetime.fromisoformat(job['run_at']) - started).total_seconds()
+        assert backoff - 1 < delay <= backoff + 1
+        # Not runnable again until the backoff has passed
+        assert jobs.claim() is None
+        make_runnable(jobs, job_id)
+    job = run_next(jobs)
+    assert (job['status'], job['attempts']) == ('failed', 3)
+    assert calls == [{'n': 1}] * 3
+
+def test_permanent_errors_are_not_retried(jobs):
+    @jobs.handler('broken')
+    def broken(payload, progress):
+        return payload['missing']
+
+    job_id = jobs.enqueue('broken')
+    job = run_next(jobs)
+    assert (job['id'], job['status'], job['attempts']) == (job_id, 'failed', 1)
+    assert 'KeyError' in job['error']
+
+def test_claim_respects_the_per_type_limit(jobs):
+    @jobs.handler('limited', max_concurrency=2)
+    def limited(payload, progress):
+        return {}
+
+    @jobs.handler('unlimited')
+    def unlimited(payload, progress):
+        return {}
+
+    ids = [jobs.enqueue('limited') for _ in range(3)]
+    other = jobs.enqueue('unlimited')
+    assert jobs.claim() == ids[0]
+    assert jobs.claim() == ids[1]
+    # The third limited job waits, but other types are still claimed
+    assert jobs.claim() == other
+    assert jobs.claim() is None
+    jobs.run_job(ids[0])
+    assert jobs.get(ids[0])['status'] == 'succeeded'
+    assert jobs.claim() == ids[2]
+
+def test_successful_jobs_store_their_result_and_progress(jobs):
+    @jobs.handler('steps')
+    def steps(payload, progress):
+        progress(0.5, 'half way')
+        return {'doubled': payload['n'] * 2}
+
+    jobs.enqueue('steps', {'n': 21})
+    job = run_next(jobs)
+    assert (job['status'], job['progress'], job['message'], job['result']) == ('succeeded', 1.0, 'half way', {'doubled': 42})
+
+@pytest.mark.parametrize('body,message', [
+    ({'type': 'nope'}, 'Job type must be one of'),
+    ({'type': 'export', 'payload': 'courses'}, "'payload' must be an object"),
+    ({'type': 'export', 'payload': {'table': 'user', 'filename': 'x.csv'}}, "'table' must be one of"),
+    ({'type': 'export', 'payload': {'table': 'courses'}}, "'filename' must be a file name"),
+    ({'type': 'export', 'payload': {'table': 'courses', 'filename': '..'}}, "'filename' must be a file name"),
+    ({'type': 'export', 'payload': {'table': 'audit_log', 'filename': 'x.csv', 'since': 'May'}}, "'since' must be"),
+    ({'type': 'export', 'payload': {'table': 'courses', 'filename': 'x.csv', 'actions': ['login']}}, 'only apply to'),
+    ({'type': 'archive_audit_log', 'payload': {'filename': 'x.jsonl.gz'}}, "'before' must be"),
+    ({'type': 'delete_course', 'payload': {'course_id': '1'}}, "'course_id' must be an integer"),
+])
+def test_invalid_payloads_are_refused(lms, auth, body, message):
+    response = lms.app.test_client().post('/jobs', json=body, headers=auth())
+    assert response.status_code == 400
+    assert message in response.json['message']
+    with lms.app.app_context():
+        assert lms.jobs.claim() is None
+
+def test_archive_is_never_overwritten(lms, auth, jobs):
+    lms.db.session.add_all([lms.AuditLog(user_id=1, action='login', details=f'entry {i}',
+                                         timestamp=datetime(2023, 12, 1) + timedelta(days=i)) for i in range(5)])
+    lms.db.session.commit()
+    client = lms.app.test_client()
+    body = {'type': 'archive_audit_log', 'payload': {'before': '2024-01-01', 'filename': 'audit-2023.jsonl.gz'}}
+    assert client.post('/jobs', json=body, headers=auth()).status_code == 202
+    job = run_next(jobs)
+    assert (job['status'], job['result']['archived']) == ('succeeded', 5)
+    path = job['result']['path']
+    with gzip.open(path, 'rt') as f:
+        archived = [json.loads(line)['details'] for line in f]
+    assert archived == [f'entry {i}' for i in range(5)]
+
+    response = client.post('/jobs', json=body, headers=auth())
+    assert response.status_code == 400
+    assert 'already exists' in response.json['message']
+    export_body = {'type': 'export', 'payload': {'table': 'courses', 'filename': 'audit-2023.jsonl.gz'}}
+    assert client.post('/jobs', json=export_body, headers=auth()).status_code == 400
+    with gzip.open(path, 'rt') as f:
+        assert len(f.readlines()) == 5
+
+def test_a_file_written_after_enqueue_is_not_overwritten(lms, auth, jobs):
+    body = {'type': 'export', 'payload': {'table': 'courses', 'filename': 'courses.csv'}}
+    assert lms.app.test_client().post('/jobs', json=body, headers=auth()).status_code == 202
+    path = lms.export_path('courses.csv')
+    with open(path, 'w') as f:
+        f.write('written by someone else\n')
+    job = run_next(jobs)
+    assert (job['status'], job['attempts']) == ('failed', 1)
+    assert 'already exists' in job['error']
+    with open(path) as f:
+        assert f.read() == 'written by someone else\n'
+
+def test_an_interrupted_export_can_be_resumed(lms, auth, jobs):
+    path = lms.export_path('courses.csv')
+    for name in (path, path + '.ckpt'):
+        with open(name, 'w') as f:
+            f.write('')
+    body = {'type': 'export', 'payload': {'table': 'courses', 'filename': 'courses.csv'}}
+    assert lms.app.test_client().post('/jobs', json=body, headers=auth()).status_code == 202
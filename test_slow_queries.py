@@ -0,0 +1,86 @@
+import logging
+import time
+
+import pytest
+from sqlalchemy import exc
+
+from slow_queries import bind_shape, is_full_scan, normalize_sql
+
+def test_normalize_sql_collapses_literals_and_whitespace():
+    assert (normalize_sql("SELECT *  FROM course\n WHERE title = 'It''s' AND duration > 10.5")
+            == 'SELECT * FROM course WHERE title = ? AND duration > ?')
+
+def test_normalize_sql_collapses_in_lists():
+    short = normalize_sql('SELECT * FROM course WHERE id IN (?, ?)')
+    long = normalize_sql('SELECT * FROM course WHERE id IN (?,?,?,?)')
+    assert short == long == 'SELECT * FROM course WHERE id IN (...)'
+    assert (normalize_sql('SELECT * FROM course WHERE id IN (__[POSTCOMPILE_id_1])')
+            == 'SELECT * FROM course WHERE id IN (...)')
+
+def test_normalize_sql_keeps_identifiers_with_digits():
+    assert normalize_sql('SELECT course_1.id FROM course AS course_1 LIMIT 5') == \
+        'SELECT course_1.id FROM course AS course_1 LIMIT ?'
+
+def test_bind_shape():
+    assert bind_shape({'title': 'x', 'limit': 3}) == 'title:str, limit:int'
+    assert bind_shape(('x', 3, None)) == 'str, int, NoneType'
+
+def test_is_full_scan():
+    assert is_full_scan(['SCAN course'])
+    assert not is_full_scan(['SEARCH course USING INDEX ix_course_title_instructor (title=?)'])
+    assert not is_full_scan(['SCAN course USING COVERING INDEX ix_course_title_instructor'])
+    assert not is_full_scan(None)
+
+@pytest.fixture
+def slow_queries(lms, monkeypatch):
+    monkeypatch.setitem(lms.app.config, 'SLOW_QUERY_THRESHOLD_MS', 0)
+    lms.slow_queries.reset()
+    yield lms.slow_queries
+    lms.slow_queries.reset()
+
+def test_statements_are_grouped_with_their_plan(lms, auth, slow_queries):
+    client = lms.app.test_client()
+    for course_id in (1, 2, 3):
+        client.get(f'/courses/{course_id}', headers=auth())
+    with lms.app.app_context():
+        lms.db.session.execute(lms.db.text("SELECT * FROM course WHERE description = 'x'")).all()
+    queries = {q['sql']: q for q in slow_queries.snapshot()['queries']}
+    by_id = queries['SELECT course.id, course.title, course.description, course.instructor, course.duration, '
+                    'course.enrollment_limit FROM course WHERE course.id = ?']
+    assert by_id['count'] == 3
+    assert by_id['bind_shapes'] == ['int']
+    assert not by_id['full_scan']
+    assert queries["SELECT * FROM course WHERE description = ?"]['full_scan']
+
+    response = client.get('/admin/slow-queries?limit=1', headers=auth())
+    assert response.status_code == 200
+    assert len(response.json['queries']) == 1 and response.json['threshold_ms'] == 0
+    assert client.get('/admin/slow-queries', headers=auth('instructor')).status_code == 403
+
+def test_the_cheapest_statement_is_evicted(lms, slow_queries, monkeypatch):
+    monkeypatch.setitem(lms.app.config, 'SLOW_QUERY_MAX_STATEMENTS', 2)
+    with lms.app.app_context(), lms.db.engine.connect() as conn:
+        slow_queries.record(conn, 'SELECT 1', (), False, 30)
+        slow_queries.record(conn, 'SELECT id FROM course', (), False, 10)
+        slow_queries.record(conn, 'SELECT title FROM course', (), False, 20)
+    assert [q['sql'] for q in slow_queries.snapshot()['queries']] == ['SELECT ?', 'SELECT title FROM course']
+
+def test_failed_statements_do_not_leak_start_times(lms, slow_queries):
+    with lms.app.app_context(), lms.db.engine.connect() as conn:
+        with pytest.raises(exc.OperationalError):
+            conn.exec_driver_sql('SELECT * FROM missing_table')
+        assert conn.info['query_start_time'] == []
+        conn.exec_driver_sql('SELECT 1')
+        assert conn.info['query_start_time'] == []
+
+def test_summary_is_logged_without_further_queries(lms, slow_queries, monkeypatch, caplog):
+    monkeypatch.setitem(lms.app.config, 'SLOW_QUERY_SUMMARY_INTERVAL', 0.05)
+    slow_queries.summarizer = None
+    with caplog.at_level(logging.WARNING, logger=lms.app.logger.name):
+        with lms.app.app_context(), lms.db.engine.connect() as conn:
+            conn.exec_driver_sql('SELECT 1')
+        monkeypatch.setitem(lms.app.config, 'SLOW_QUERY_THRESHOLD_MS', 10 ** 6)
+        deadline = time.monotonic() + 2
+        while 'Slowest queries' not in caplog.text and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert 'SELECT ?' in caplog.text